@@ -1,30 +1,125 @@
+import asyncio
+import hmac
+import json
 import logging
-import time
-from typing import Optional
+from typing import AsyncIterator, List, Optional, Tuple
 
 from pydantic import BaseModel
 
-from agent_search.core.utils import load_config, select_top_urls
-from agent_search.search import WebSearchEngine
+from agent_search.app.readiness import Readiness
+from agent_search.core.cache import ResultCache
+from agent_search.core.metrics import METRICS, format_server_timing
+from agent_search.core.utils import iter_top_urls, load_config
+from agent_search.search import (
+    AsyncWebSearchEngine,
+    SearchFilter,
+    VectorSearch,
+)
+from agent_search.search.postgres import FetchStatus, track_fetches
+from agent_search.search.result_batch import ResultBatch
 
 # Attempt to import uvicorn and FastAPI
 try:
     import uvicorn
-    from fastapi import FastAPI, HTTPException
+    from fastapi import FastAPI, Header, HTTPException, Response
+    from fastapi.responses import (
+        JSONResponse,
+        PlainTextResponse,
+        StreamingResponse,
+    )
 except ImportError as e:
     raise ImportError(
         f"Error: {e}, Note - both uvicorn and FastAPI are required to run the server."
     )
 
-
 logger = logging.getLogger(__name__)
 
 
 class SearchServer:
-    def __init__(self):
-        self.client = WebSearchEngine()
+    def __init__(self, client: Optional[AsyncWebSearchEngine] = None):
+        self.config = load_config()["server"]
+        self.client = client or AsyncWebSearchEngine()
+        self.result_cache = ResultCache.from_config(self.config)
+        METRICS.enabled = self.config.getboolean("metrics_enabled", True)
+        self.max_batch_queries = int(self.config.get("max_batch_queries", 32))
+
+    async def connect(self):
+        """Open the connections used by the WebSearchEngine client"""
+        await self.client.connect()
+
+    async def close(self):
+        """Close the connections used by the WebSearchEngine client"""
+        await self.client.close()
+        if self.result_cache is not None:
+            await self.result_cache.close()
+
+    async def invalidate_cache(self):
+        """Drop all cached results, to be called after the index is re-populated"""
+        if self.result_cache is not None:
+            await self.result_cache.invalidate()
+
+    async def _cache_results(
+        self, cache_key: str, results: list, fetch_status: FetchStatus
+    ):
+        """Cache complete results only, as empty or partial ones would outlive the failure behind them"""
+        if not results or fetch_status.degraded:
+            return
+        await self.result_cache.set(cache_key, results)
 
-    def run(
+    def get_stats(self) -> dict:
+        """Collect the statistics of the client and the result cache"""
+        stats = self.client.get_stats()
+        if self.result_cache is not None:
+            stats["result_cache"] = self.result_cache.get_stats()
+        return stats
+
+    async def warm_up(self):
+        """Run a throwaway query through every stage, bypassing the result cache,
+        so that the first real request does not pay for lazy initialization"""
+        query = self.config.get("warm_up_query")
+        if not query:
+            return
+        params = self._request_params(
+            limit_broad_results=10,
+            limit_deduped_url_results=5,
+            limit_hierarchical_url_results=5,
+            limit_final_pagerank_results=5,
+            url_contains_filter=None,
+            domain_filter=None,
+            search_profile=None,
+            hnsw_ef=None,
+        )
+        await self._run_pipeline(query, **params)
+
+    def _request_params(
+        self,
+        limit_broad_results,
+        limit_deduped_url_results,
+        limit_hierarchical_url_results,
+        limit_final_pagerank_results,
+        url_contains_filter,
+        domain_filter,
+        search_profile,
+        hnsw_ef,
+    ) -> dict:
+        """Normalize the request parameters, which also form the result cache key"""
+
+        # Resolved up front, so that invalid profiles fail before any work
+        precision = self.client.search_profiles.resolve(
+            search_profile, hnsw_ef
+        )
+        return dict(
+            limit_broad_results=limit_broad_results,
+            limit_deduped_url_results=limit_deduped_url_results,
+            limit_hierarchical_url_results=limit_hierarchical_url_results,
+            limit_final_pagerank_results=limit_final_pagerank_results,
+            url_contains_filter=url_contains_filter or [],
+            domain_filter=[domain.lower() for domain in domain_filter or []],
+            precision=precision,
+        )
+
+    @METRICS.timed("search")
+    async def run(
         self,
         query="What is a lagrangian?",
         limit_broad_results=1_000,
@@ -32,51 +127,290 @@ class SearchServer:
         limit_hierarchical_url_results=50,
         limit_final_pagerank_results=20,
         url_contains_filter=None,
+        domain_filter=None,
+        search_profile=None,
+        hnsw_ef=None,
     ):
-        """Run a search query using the WebSearchEngine client"""
+        """Run a search query using the WebSearchEngine client, serving repeated requests from the result cache"""
+
+        params = self._request_params(
+            limit_broad_results,
+            limit_deduped_url_results,
+            limit_hierarchical_url_results,
+            limit_final_pagerank_results,
+            url_contains_filter,
+            domain_filter,
+            search_profile,
+            hnsw_ef,
+        )
+        if self.result_cache is None:
+            return await self._run_pipeline(query, **params)
+
+        cache_key = self.result_cache.make_key(query, **params)
+        with METRICS.timer("result_cache"):
+            results = await self.result_cache.get(cache_key)
+        if results is None:
+            with track_fetches() as fetch_status:
+                results = await self._run_pipeline(query, **params)
+            await self._cache_results(cache_key, results, fetch_status)
+        return results
 
-        query_vector = self.client.get_query_vector(query)
+    @METRICS.timed("search_batch")
+    async def run_batch(self, queries: List[dict]) -> List[list]:
+        """Run several search queries together, each a dict of the `run` arguments.
+
+        The queries share one embedding forward pass, one vector store request
+        and one Postgres fetch of the union of their URLs, and are then
+        reranked separately. Cached queries are served from the cache.
+        """
+
+        queries = [dict(query) for query in queries]
+        texts = [query.pop("query") for query in queries]
+        params = [
+            self._request_params(
+                query.get("limit_broad_results", 1_000),
+                query.get("limit_deduped_url_results", 50),
+                query.get("limit_hierarchical_url_results", 50),
+                query.get("limit_final_pagerank_results", 20),
+                query.get("url_contains_filter"),
+                query.get("domain_filter"),
+                query.get("search_profile"),
+                query.get("hnsw_ef"),
+            )
+            for query in queries
+        ]
 
-        broad_results = self.client.similarity_search(
-            query_vector=query_vector, limit=limit_broad_results
+        results: List[Optional[list]] = [None] * len(texts)
+        cache_keys: List[Optional[str]] = [None] * len(texts)
+        if self.result_cache is not None:
+            for i, (text, query_params) in enumerate(zip(texts, params)):
+                cache_keys[i] = self.result_cache.make_key(
+                    text, **query_params
+                )
+                with METRICS.timer("result_cache"):
+                    results[i] = await self.result_cache.get(cache_keys[i])
+        missing = [i for i, result in enumerate(results) if result is None]
+        if not missing:
+            return results
+
+        query_vectors = await self.client.get_query_vectors(
+            [texts[i] for i in missing]
+        )
+        broad_results = await self.client.similarity_search_batch(
+            [
+                VectorSearch(
+                    query_vector,
+                    limit=params[i]["limit_deduped_url_results"]
+                    if self.client.broad_search_grouped
+                    else params[i]["limit_broad_results"],
+                    search_filter=SearchFilter(
+                        params[i]["url_contains_filter"],
+                        params[i]["domain_filter"],
+                    ),
+                    payload_fields=self.client.broad_payload_fields,
+                    precision=params[i]["precision"],
+                )
+                for i, query_vector in zip(missing, query_vectors)
+            ],
+            grouped=self.client.broad_search_grouped,
         )
+        url_lists = [
+            list(
+                iter_top_urls(
+                    batch.urls,
+                    max_urls=params[i]["limit_deduped_url_results"],
+                    url_contains=params[i]["url_contains_filter"],
+                )
+            )
+            for i, batch in zip(missing, broad_results)
+        ]
+        with track_fetches() as fetch_status:
+            hierarchical_results = (
+                await self.client.hierarchical_similarity_reranking_batch(
+                    query_vectors,
+                    url_lists,
+                    [
+                        params[i]["limit_hierarchical_url_results"]
+                        for i in missing
+                    ],
+                )
+            )
+        for i, batch in zip(missing, hierarchical_results):
+            results[i] = self.client.pagerank_reranking(
+                batch, limit=params[i]["limit_final_pagerank_results"]
+            ).to_results()
+            if self.result_cache is not None:
+                await self._cache_results(
+                    cache_keys[i], results[i], fetch_status
+                )
+        return results
 
-        if not url_contains_filter:
-            url_contains_filter = []
+    def stream(
+        self,
+        query="What is a lagrangian?",
+        limit_broad_results=1_000,
+        limit_deduped_url_results=50,
+        limit_hierarchical_url_results=50,
+        limit_final_pagerank_results=20,
+        url_contains_filter=None,
+        domain_filter=None,
+        search_profile=None,
+        hnsw_ef=None,
+    ) -> AsyncIterator[dict]:
+        """Run a search query, yielding provisional results as each stage completes.
+
+        Each event holds the `stage` it follows, one of broad, hierarchical or
+        pagerank, its `results`, and whether they are the `final` ones. The
+        parameters are validated before the returned iterator is consumed.
+        """
+
+        params = self._request_params(
+            limit_broad_results,
+            limit_deduped_url_results,
+            limit_hierarchical_url_results,
+            limit_final_pagerank_results,
+            url_contains_filter,
+            domain_filter,
+            search_profile,
+            hnsw_ef,
+        )
+        return self._stream_pipeline(query, params)
+
+    async def _stream_pipeline(
+        self, query: str, params: dict
+    ) -> AsyncIterator[dict]:
+        cache_key = None
+        if self.result_cache is not None:
+            cache_key = self.result_cache.make_key(query, **params)
+            results = await self.result_cache.get(cache_key)
+            if results is not None:
+                yield {"stage": "pagerank", "final": True, "results": results}
+                return
+
+        # The broad results are streamed, so their hits need the chunk text
+        # even when the broad stage otherwise only fetches URLs
+        payload_fields = self.client.broad_payload_fields
+        if payload_fields is not None and "text" not in payload_fields:
+            payload_fields = (*payload_fields, "text")
+        with track_fetches() as fetch_status:
+            async for stage, batch in self._iter_pipeline(
+                query, broad_payload_fields=payload_fields, **params
+            ):
+                if stage == "broad":
+                    # The best chunk of each of the best distinct URLs,
+                    # before the chunks of every URL are reranked
+                    results = batch.unique_urls(
+                        params["limit_final_pagerank_results"]
+                    ).to_results()
+                else:
+                    results = batch.to_results()
+                final = stage == "pagerank"
+                if final and cache_key is not None:
+                    await self._cache_results(cache_key, results, fetch_status)
+                yield {"stage": stage, "final": final, "results": results}
+
+    async def _run_pipeline(self, query, **params):
+        """Run the pipeline to completion, returning only the final results"""
+        async for stage, batch in self._iter_pipeline(
+            query,
+            broad_payload_fields=self.client.broad_payload_fields,
+            **params,
+        ):
+            if stage == "pagerank":
+                # Only the final results are materialized as pydantic objects
+                with METRICS.timer("serialize"):
+                    return batch.to_results()
+
+    async def _iter_pipeline(
+        self,
+        query,
+        limit_broad_results,
+        limit_deduped_url_results,
+        limit_hierarchical_url_results,
+        limit_final_pagerank_results,
+        url_contains_filter,
+        domain_filter,
+        precision,
+        broad_payload_fields,
+    ) -> AsyncIterator[Tuple[str, ResultBatch]]:
+        """Run the embed, vector search, hierarchical and pagerank stages, yielding the results of each
 
-        deduped_url_results = select_top_urls(
-            broad_results,
+        The broad hits carry `broad_payload_fields`, their full payloads when None.
+        """
+
+        query_vector = await self.client.get_query_vector(query)
+
+        # The filters are pushed down, so the broad stage only returns
+        # candidates which can survive deduplication
+        search_filter = SearchFilter(url_contains_filter, domain_filter)
+        if self.client.broad_search_grouped:
+            # One point per distinct URL, so no over-fetching is needed
+            broad_results = await self.client.grouped_similarity_search(
+                query_vector=query_vector,
+                limit=limit_deduped_url_results,
+                search_filter=search_filter,
+                payload_fields=broad_payload_fields,
+                precision=precision,
+            )
+        else:
+            broad_results = await self.client.similarity_search(
+                query_vector=query_vector,
+                limit=limit_broad_results,
+                search_filter=search_filter,
+                payload_fields=broad_payload_fields,
+                precision=precision,
+            )
+        METRICS.count("broad", len(broad_results))
+        yield "broad", broad_results
+
+        deduped_url_results = iter_top_urls(
+            broad_results.urls,
             max_urls=limit_deduped_url_results,
             url_contains=url_contains_filter,
         )
 
         hierarchical_url_results = (
-            self.client.hierarchical_similarity_reranking(
+            await self.client.hierarchical_similarity_reranking(
                 query_vector=query_vector,
                 urls=deduped_url_results,
                 limit=limit_hierarchical_url_results,
             )
         )
+        METRICS.count("hierarchical", len(hierarchical_url_results))
+        yield "hierarchical", hierarchical_url_results
 
         pagerank_reranked_results = self.client.pagerank_reranking(
-            hierarchical_url_results
-        )[:limit_final_pagerank_results]
-
-        return pagerank_reranked_results
+            hierarchical_url_results, limit=limit_final_pagerank_results
+        )
+        METRICS.count("pagerank", len(pagerank_reranked_results))
+        yield "pagerank", pagerank_reranked_results
 
 
 class SearchQuery(BaseModel):
     """A search query data model"""
 
     query: str
+    # Not used when the server's broad_search_mode is grouped
     limit_broad_results: Optional[int] = 1_000
     limit_deduped_url_results: Optional[int] = 100
     limit_hierarchical_url_results: Optional[int] = 25
     limit_final_pagerank_results: Optional[int] = 10
+    url_contains_filter: Optional[List[str]] = None
+    domain_filter: Optional[List[str]] = None
+    # One of fast, balanced or exact, the server's default when unset
+    search_profile: Optional[str] = None
+    hnsw_ef: Optional[int] = None
+
+
+class SearchBatchQuery(BaseModel):
+    """A batch of search queries run together"""
+
+    queries: List[SearchQuery]
 
 
 app = FastAPI()
-search_runner = SearchServer()
+search_runner: Optional[SearchServer] = None
+readiness = Readiness()
 
 
 def check_limits(query: SearchQuery):
@@ -99,33 +433,186 @@ def check_limits(query: SearchQuery):
         )
 
 
+async def start_search_runner():
+    """Load the model, connect and warm up, only then marking the server as ready"""
+    global search_runner
+    try:
+        runner = await readiness.timed("init", asyncio.to_thread(SearchServer))
+        await readiness.timed("connect", runner.connect())
+        await readiness.timed("warm_up", runner.warm_up())
+    except Exception as e:
+        logger.error(f"Search server failed to start with {e}")
+        readiness.status, readiness.error = "failed", str(e)
+        return
+    search_runner = runner
+    readiness.ready()
+    logger.info(f"Search server ready, start-up timings {readiness.timings}")
+
+
+def get_search_runner() -> SearchServer:
+    """The search runner, or a 503 while it is still starting up"""
+    if search_runner is None:
+        raise HTTPException(
+            status_code=503, detail=f"Search server is {readiness.status}"
+        )
+    return search_runner
+
+
+@app.on_event("startup")
+async def startup():
+    """Start the search runner in the background, so the server binds before the model has loaded"""
+    readiness.task = asyncio.create_task(start_search_runner())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Release the search runner connections"""
+    if readiness.task is not None and not readiness.task.done():
+        readiness.task.cancel()
+    if search_runner is not None:
+        await search_runner.close()
+
+
 @app.post("/search")
-def run_search(query: SearchQuery):
-    """Run a search query"""
+async def run_search(query: SearchQuery, response: Response):
+    """Run a search query, reporting the time spent in each stage in the Server-Timing header"""
+    search_runner = get_search_runner()
+    try:
+        check_limits(query)
+        with METRICS.request_timings() as timings:
+            results = await search_runner.run(
+                query=query.query,
+                limit_broad_results=query.limit_broad_results,
+                limit_deduped_url_results=query.limit_deduped_url_results,
+                limit_hierarchical_url_results=query.limit_hierarchical_url_results,
+                limit_final_pagerank_results=query.limit_final_pagerank_results,
+                url_contains_filter=query.url_contains_filter,
+                domain_filter=query.domain_filter,
+                search_profile=query.search_profile,
+                hnsw_ef=query.hnsw_ef,
+            )
+        if timings:
+            response.headers["Server-Timing"] = format_server_timing(timings)
+        return {"results": results}
+    except ValueError as e:
+        logger.error(f"ValueError {e} = ", e)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Exception {e} = ", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/search/batch")
+async def run_search_batch(batch: SearchBatchQuery, response: Response):
+    """Run a batch of search queries, returning the results of each in order"""
+    search_runner = get_search_runner()
+    try:
+        if len(batch.queries) > search_runner.max_batch_queries:
+            raise ValueError(
+                f"A batch can hold at most {search_runner.max_batch_queries} queries"
+            )
+        for query in batch.queries:
+            check_limits(query)
+        with METRICS.request_timings() as timings:
+            results = await search_runner.run_batch(
+                [query.dict() for query in batch.queries]
+            )
+        if timings:
+            response.headers["Server-Timing"] = format_server_timing(timings)
+        return {"results": results}
+    except ValueError as e:
+        logger.error(f"ValueError {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Exception {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/search/stream")
+async def run_search_stream(query: SearchQuery):
+    """Run a search query, streaming the results of each stage as NDJSON"""
+    search_runner = get_search_runner()
     try:
         check_limits(query)
-        results = search_runner.run(
+        events = search_runner.stream(
             query=query.query,
             limit_broad_results=query.limit_broad_results,
             limit_deduped_url_results=query.limit_deduped_url_results,
             limit_hierarchical_url_results=query.limit_hierarchical_url_results,
             limit_final_pagerank_results=query.limit_final_pagerank_results,
+            url_contains_filter=query.url_contains_filter,
+            domain_filter=query.domain_filter,
+            search_profile=query.search_profile,
+            hnsw_ef=query.hnsw_ef,
         )
-        return {"results": results}
     except ValueError as e:
-        logger.error(f"ValueError {e} = ", e)
+        logger.error(f"ValueError {e}")
         raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        logger.error(f"Exception {e} = ", e)
-        raise HTTPException(status_code=500, detail=str(e))
+
+    async def ndjson_events():
+        try:
+            async for event in events:
+                event["results"] = [
+                    result.dict() for result in event["results"]
+                ]
+                yield json.dumps(event) + "\n"
+        except Exception as e:
+            # The status is already sent, so errors are reported in-band
+            logger.error(f"Exception {e}")
+            yield json.dumps({"error": str(e)}) + "\n"
+
+    return StreamingResponse(
+        ndjson_events(), media_type="application/x-ndjson"
+    )
+
+
+@app.get("/stats")
+def stats():
+    """Connection pool and cache statistics, along with the start-up timings"""
+    if search_runner is None:
+        return {"startup": readiness.to_dict()}
+    stats = search_runner.get_stats()
+    stats["startup"] = readiness.to_dict()
+    return stats
+
+
+@app.post("/cache/invalidate")
+async def invalidate_cache(x_admin_token: Optional[str] = Header(None)):
+    """Drop all cached search results, given the configured admin token"""
+    search_runner = get_search_runner()
+    # The endpoint stays disabled until a token is configured
+    admin_token = search_runner.config.get("cache_invalidate_token", "")
+    if not admin_token or not hmac.compare_digest(
+        (x_admin_token or "").encode("utf-8"), admin_token.encode("utf-8")
+    ):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+    await search_runner.invalidate_cache()
+    return {"status": "ok"}
+
+
+@app.get("/metrics")
+def metrics():
+    """Per-stage latency and candidate count histograms, in the Prometheus text format"""
+    return PlainTextResponse(
+        METRICS.render(), media_type="text/plain; version=0.0.4"
+    )
 
 
 @app.get("/health")
 def health_check():
-    """Health check endpoint"""
+    """Liveness endpoint, ok as soon as the server accepts requests"""
     return {"status": "ok"}
 
 
+@app.get("/ready")
+def ready_check():
+    """Readiness endpoint, ok only once the model is loaded and warmed up"""
+    return JSONResponse(
+        readiness.to_dict(),
+        status_code=200 if readiness.status == "ready" else 503,
+    )
+
+
 if __name__ == "__main__":
     config = load_config()["server"]
     logging.basicConfig(level=config["log_level"])
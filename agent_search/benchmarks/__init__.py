@@ -0,0 +1,12 @@
+from .engine import InMemorySearchEngine
+from .pipeline import LIMIT_PRESETS, PipelineBenchmark, compare_reports
+from .synthetic import StubEncoder, SyntheticCorpus
+
+__all__ = [
+    "InMemorySearchEngine",
+    "LIMIT_PRESETS",
+    "PipelineBenchmark",
+    "StubEncoder",
+    "SyntheticCorpus",
+    "compare_reports",
+]
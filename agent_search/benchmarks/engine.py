@@ -0,0 +1,72 @@
+import asyncio
+import configparser
+import os
+from typing import Dict, List, Optional
+
+from agent_search.core.metrics import METRICS
+from agent_search.core.utils import load_config
+from agent_search.search import AsyncWebSearchEngine, LocalVectorStore
+
+from .synthetic import SyntheticCorpus
+
+# The engine caches and the embedding batcher are off, so that every query
+# goes through every stage
+BENCHMARK_CONFIG = {
+    "embedding_cache_max_bytes": "0",
+    "embedding_batch_max_size": "1",
+    "url_record_cache_max_bytes": "0",
+    "pagerank_rerank_module": "True",
+    "pagerank_table_path": "",
+    "public_suffix_file_path": "",
+}
+
+
+class InMemorySearchEngine(AsyncWebSearchEngine):
+    """The async engine over a synthetic corpus, with in-memory stand-ins for Qdrant and Postgres.
+
+    The vector store is a local exact index of the corpus, the Postgres
+    fetch is a lookup of its rows, optionally delayed by `fetch_latency_ms`
+    to model the round trip, and the embedding model is a stub encoder.
+    """
+
+    def __init__(
+        self,
+        corpus: SyntheticCorpus,
+        data_dir: str,
+        config_overrides: Optional[Dict[str, str]] = None,
+        fetch_latency_ms: float = 0.0,
+    ):
+        self.corpus = corpus
+        self.fetch_latency_ms = fetch_latency_ms
+        pagerank_file_path = corpus.write_domain_ranks(
+            os.path.join(data_dir, "domain_ranks.csv")
+        )
+        self.config_overrides = dict(
+            BENCHMARK_CONFIG, pagerank_file_path=pagerank_file_path
+        )
+        self.config_overrides.update(
+            {
+                key: str(value)
+                for key, value in (config_overrides or {}).items()
+            }
+        )
+        super().__init__(LocalVectorStore(corpus.vectors, corpus.payloads))
+
+    def _load_config(self):
+        config = configparser.ConfigParser()
+        config.read_dict(load_config())
+        config["agent_search"].update(self.config_overrides)
+        return config["agent_search"]
+
+    def _load_embedding_model(self):
+        return self.corpus.encoder()
+
+    async def connect(self):
+        await self.vector_store.aconnect()
+
+    @METRICS.timed("postgres_fetch")
+    async def execute_batch_query(self, urls: List[str]) -> List[tuple]:
+        if self.fetch_latency_ms > 0:
+            await asyncio.sleep(self.fetch_latency_ms / 1_000.0)
+        rows = self.corpus.rows
+        return [rows[url] for url in urls if url in rows]
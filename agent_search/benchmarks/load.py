@@ -0,0 +1,314 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+import requests
+
+from agent_search.core.utils import get_data_path
+
+logger = logging.getLogger(__name__)
+
+REPORT_VERSION = 1
+
+
+def read_query_log(path: str) -> List[dict]:
+    """Reads a query log of one /search request body per line, in JSON.
+
+    Lines which are not JSON objects are taken as bare query strings, and
+    blank lines and lines starting with # are skipped.
+    """
+    queries = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                query = json.loads(line)
+            except json.JSONDecodeError:
+                query = line
+            queries.append(
+                query if isinstance(query, dict) else {"query": str(query)}
+            )
+    if not queries:
+        raise ValueError(f"The query log at {path} holds no queries.")
+    return queries
+
+
+def default_query_log_path() -> str:
+    return os.path.join(get_data_path(), "load_test_queries.jsonl")
+
+
+def parse_server_timing(header: Optional[str]) -> Dict[str, float]:
+    """The stage durations of a Server-Timing header, in milliseconds"""
+    timings: Dict[str, float] = {}
+    for entry in (header or "").split(","):
+        name, *params = [part.strip() for part in entry.split(";")]
+        for param in params:
+            if param.startswith("dur="):
+                try:
+                    timings[name] = float(param[len("dur=") :])
+                except ValueError:
+                    pass
+    return timings
+
+
+class LoadTest:
+    """A closed-loop load generator for the /search endpoint.
+
+    Each of `concurrency` workers sends its next request as soon as the
+    previous one completes, replaying the query log in order and wrapping
+    around, so that runs over the same log are comparable.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        queries: Sequence[dict],
+        timeout: float = 30.0,
+        endpoint: str = "/search",
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.queries = list(queries)
+        self.timeout = timeout
+        self.endpoint = endpoint
+
+    def run_level(
+        self,
+        concurrency: int,
+        duration_seconds: float = 30.0,
+        warm_up_seconds: float = 5.0,
+    ) -> dict:
+        """Runs `concurrency` workers for the warm-up and then the measured duration"""
+        samples: List[tuple] = []
+        lock = threading.Lock()
+        next_query = iter(range(sys.maxsize))
+        start = time.perf_counter()
+        measure_from = start + warm_up_seconds
+        stop_at = measure_from + duration_seconds
+
+        def worker():
+            session = requests.Session()
+            while time.perf_counter() < stop_at:
+                with lock:
+                    query = self.queries[next(next_query) % len(self.queries)]
+                sent_at = time.perf_counter()
+                server_timing = None
+                try:
+                    response = session.post(
+                        self.base_url + self.endpoint,
+                        json=query,
+                        timeout=self.timeout,
+                    )
+                    status = str(response.status_code)
+                    server_timing = response.headers.get("Server-Timing")
+                except requests.Timeout:
+                    status = "timeout"
+                except requests.RequestException:
+                    status = "connection_error"
+                completed_at = time.perf_counter()
+                if sent_at >= measure_from and completed_at <= stop_at:
+                    with lock:
+                        samples.append(
+                            (completed_at - sent_at, status, server_timing)
+                        )
+            session.close()
+
+        threads = [
+            threading.Thread(target=worker, daemon=True)
+            for _ in range(concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self._summarize(concurrency, duration_seconds, samples)
+
+    @staticmethod
+    def _summarize(
+        concurrency: int, duration_seconds: float, samples: List[tuple]
+    ) -> dict:
+        statuses: Dict[str, int] = {}
+        for _, status, _ in samples:
+            statuses[status] = statuses.get(status, 0) + 1
+        ok = [sample for sample in samples if sample[1] == "200"]
+        errors = len(samples) - len(ok)
+        result = {
+            "concurrency": concurrency,
+            "requests": len(samples),
+            "statuses": statuses,
+            "error_rate": errors / len(samples) if samples else 0.0,
+            "throughput_rps": len(ok) / duration_seconds,
+        }
+        if ok:
+            millis = np.array([latency for latency, _, _ in ok]) * 1_000.0
+            result["latency_ms"] = {
+                "mean": float(millis.mean()),
+                "p50": float(np.percentile(millis, 50)),
+                "p95": float(np.percentile(millis, 95)),
+                "p99": float(np.percentile(millis, 99)),
+            }
+            # The mean time of each stage on the server, which shows where
+            # the extra latency goes as the concurrency grows
+            stage_totals: Dict[str, float] = {}
+            for _, _, server_timing in ok:
+                for stage, ms in parse_server_timing(server_timing).items():
+                    stage_totals[stage] = stage_totals.get(stage, 0.0) + ms
+            result["server_stage_ms"] = {
+                stage: total / len(ok)
+                for stage, total in sorted(stage_totals.items())
+            }
+        return result
+
+    def server_stats(self) -> Optional[dict]:
+        """The /stats of the server, holding its Postgres pool statistics"""
+        try:
+            response = requests.get(self.base_url + "/stats", timeout=5)
+            response.raise_for_status()
+            return response.json()
+        except requests.RequestException as e:
+            logger.warning(f"Could not read the server stats: {e}")
+            return None
+
+    def sweep(
+        self,
+        concurrency_levels: Sequence[int],
+        duration_seconds: float = 30.0,
+        warm_up_seconds: float = 5.0,
+    ) -> dict:
+        """Runs each concurrency level in turn, returning the report and its saturation point"""
+        levels = []
+        for concurrency in concurrency_levels:
+            result = self.run_level(
+                concurrency, duration_seconds, warm_up_seconds
+            )
+            result["server_stats"] = self.server_stats()
+            logger.info(
+                f"Concurrency {concurrency}: {result['throughput_rps']:.1f} requests/s, "
+                f"error rate {result['error_rate']:.2%}"
+            )
+            levels.append(result)
+        return {
+            "version": REPORT_VERSION,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "base_url": self.base_url,
+            "queries": len(self.queries),
+            "duration_seconds": duration_seconds,
+            "levels": levels,
+            "saturation": saturation_point(levels),
+        }
+
+
+def saturation_point(
+    levels: Sequence[dict], min_gain: float = 0.1, max_error_rate: float = 0.01
+) -> Optional[dict]:
+    """The level past which more concurrency stops paying off.
+
+    That is the last level before throughput grows by less than `min_gain`
+    of itself, or before the error rate exceeds `max_error_rate`. None when
+    every level still scaled.
+    """
+    for previous, level in zip(levels, levels[1:]):
+        gain = (
+            level["throughput_rps"] / previous["throughput_rps"] - 1.0
+            if previous["throughput_rps"] > 0
+            else 0.0
+        )
+        if gain < min_gain or level["error_rate"] > max_error_rate:
+            return {
+                "concurrency": previous["concurrency"],
+                "throughput_rps": previous["throughput_rps"],
+                "p99_ms": previous.get("latency_ms", {}).get("p99"),
+            }
+    return None
+
+
+def format_load_report(report: dict) -> str:
+    """A plain text saturation curve, one row per concurrency level"""
+    lines = [
+        f"{'concurrency':>11}{'requests':>10}{'rps':>10}{'errors':>9}"
+        f"{'p50_ms':>10}{'p95_ms':>10}{'p99_ms':>10}"
+    ]
+    for level in report["levels"]:
+        latency = level.get("latency_ms", {})
+        lines.append(
+            f"{level['concurrency']:>11}{level['requests']:>10}"
+            f"{level['throughput_rps']:>10.1f}{level['error_rate']:>9.2%}"
+            + "".join(
+                f"{latency[p]:>10.1f}" if p in latency else f"{'-':>10}"
+                for p in ("p50", "p95", "p99")
+            )
+        )
+    saturation = report.get("saturation")
+    if saturation is None:
+        lines.append("Throughput still scaled at the highest concurrency.")
+    else:
+        lines.append(
+            f"Saturated at concurrency {saturation['concurrency']}, "
+            f"{saturation['throughput_rps']:.1f} requests/s"
+        )
+    return "\n".join(lines)
+
+
+@contextmanager
+def local_server(
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    workers: int = 1,
+    ready_timeout: float = 600.0,
+) -> Iterator[str]:
+    """Starts the search server under uvicorn and yields its URL once /ready reports ok"""
+    base_url = f"http://{host}:{port}"
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "agent_search.app.server:app",
+            "--host",
+            host,
+            "--port",
+            str(port),
+            "--workers",
+            str(workers),
+            "--log-level",
+            "warning",
+        ]
+    )
+    try:
+        deadline = time.monotonic() + ready_timeout
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(
+                    f"The search server exited with code {process.returncode} before becoming ready."
+                )
+            try:
+                response = requests.get(base_url + "/ready", timeout=5)
+                if response.status_code == 200:
+                    break
+                if response.json().get("status") == "failed":
+                    raise RuntimeError(
+                        f"The search server failed to start: {response.json().get('error')}"
+                    )
+            except requests.RequestException:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(
+                    f"The search server was not ready after {ready_timeout}s."
+                )
+            time.sleep(0.5)
+        logger.info(f"Search server ready at {base_url}")
+        yield base_url
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
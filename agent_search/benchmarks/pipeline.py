@@ -0,0 +1,346 @@
+import asyncio
+import json
+import logging
+import platform
+import tempfile
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from agent_search.core.metrics import METRICS
+from agent_search.core.utils import select_top_urls
+
+from .engine import InMemorySearchEngine
+from .synthetic import SyntheticCorpus
+
+logger = logging.getLogger(__name__)
+
+BASELINE_VERSION = 1
+
+# The limit settings benchmarked, from the smallest requests to the largest
+# ones accepted by the server
+LIMIT_PRESETS: Dict[str, Dict[str, int]] = {
+    "small": dict(
+        limit_broad_results=100,
+        limit_deduped_url_results=25,
+        limit_hierarchical_url_results=10,
+        limit_final_pagerank_results=5,
+    ),
+    "default": dict(
+        limit_broad_results=1_000,
+        limit_deduped_url_results=100,
+        limit_hierarchical_url_results=25,
+        limit_final_pagerank_results=10,
+    ),
+    "large": dict(
+        limit_broad_results=3_000,
+        limit_deduped_url_results=300,
+        limit_hierarchical_url_results=75,
+        limit_final_pagerank_results=30,
+    ),
+}
+
+
+def summarize(seconds: Sequence[float]) -> Dict[str, float]:
+    """The mean and percentiles of a list of durations, in milliseconds"""
+    millis = np.asarray(seconds, dtype=np.float64) * 1_000.0
+    return {
+        "mean_ms": float(millis.mean()),
+        "p50_ms": float(np.percentile(millis, 50)),
+        "p95_ms": float(np.percentile(millis, 95)),
+        "p99_ms": float(np.percentile(millis, 99)),
+    }
+
+
+class PipelineBenchmark:
+    """Times `SearchServer.run` over synthetic corpora of several sizes, with each limit preset.
+
+    Per query, the stage timings collected by the metrics registry are
+    recorded, `search` being the end-to-end latency. The dedupe, hierarchical and
+    PageRank steps are also timed on their own, from the broad results of
+    the same queries.
+    """
+
+    def __init__(
+        self,
+        corpus_sizes: Sequence[int] = (1_000, 10_000),
+        presets: Sequence[str] = ("small", "default", "large"),
+        num_queries: int = 200,
+        warm_up_queries: int = 10,
+        concurrency: int = 1,
+        chunks_per_url: int = 4,
+        fetch_latency_ms: float = 0.0,
+        seed: int = 0,
+    ):
+        unknown = [preset for preset in presets if preset not in LIMIT_PRESETS]
+        if unknown:
+            raise ValueError(
+                f"Unknown limit presets {', '.join(unknown)}, expected some of {', '.join(LIMIT_PRESETS)}."
+            )
+        self.corpus_sizes = list(corpus_sizes)
+        self.presets = list(presets)
+        self.num_queries = num_queries
+        self.warm_up_queries = warm_up_queries
+        self.concurrency = concurrency
+        self.chunks_per_url = chunks_per_url
+        self.fetch_latency_ms = fetch_latency_ms
+        self.seed = seed
+
+    def settings(self) -> dict:
+        return {
+            "corpus_sizes": self.corpus_sizes,
+            "presets": self.presets,
+            "num_queries": self.num_queries,
+            "concurrency": self.concurrency,
+            "chunks_per_url": self.chunks_per_url,
+            "fetch_latency_ms": self.fetch_latency_ms,
+            "seed": self.seed,
+        }
+
+    async def run(self) -> dict:
+        """Runs every corpus size and preset, returning a baseline-shaped report"""
+        # Imported here, so that the synthetic corpus can be used without
+        # the server's dependencies
+        from agent_search.app.server import SearchServer
+
+        results = []
+        for corpus_size in self.corpus_sizes:
+            start = time.perf_counter()
+            corpus = SyntheticCorpus.generate(
+                corpus_size, chunks_per_url=self.chunks_per_url, seed=self.seed
+            )
+            logger.info(
+                f"Generated a corpus of {corpus_size} URLs in {time.perf_counter() - start:.1f}s"
+            )
+            with tempfile.TemporaryDirectory() as data_dir:
+                engine = InMemorySearchEngine(
+                    corpus, data_dir, fetch_latency_ms=self.fetch_latency_ms
+                )
+                server = SearchServer(client=engine)
+                # Repeated queries would otherwise be served from the cache
+                server.result_cache = None
+                METRICS.enabled = True
+                await server.connect()
+                try:
+                    queries = corpus.queries(
+                        self.warm_up_queries + self.num_queries
+                    )
+                    for preset in self.presets:
+                        result = await self._run_preset(
+                            server, queries, LIMIT_PRESETS[preset]
+                        )
+                        result.update(corpus_size=corpus_size, preset=preset)
+                        logger.info(
+                            f"{corpus_size} URLs, {preset} limits: {result['throughput_qps']:.1f} queries/s, "
+                            f"p50 {result['stages']['search']['p50_ms']:.2f}ms"
+                        )
+                        results.append(result)
+                finally:
+                    await server.close()
+        return {
+            "version": BASELINE_VERSION,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "settings": self.settings(),
+            "results": results,
+        }
+
+    async def _run_preset(self, server, queries: List[str], limits: dict):
+        warm_up, queries = (
+            queries[: self.warm_up_queries],
+            queries[self.warm_up_queries :],
+        )
+        for query in warm_up:
+            await server.run(query, **limits)
+
+        stage_timings: Dict[str, List[float]] = {}
+        pending = iter(queries)
+
+        async def worker():
+            for query in pending:
+                with METRICS.request_timings() as timings:
+                    await server.run(query, **limits)
+                for stage, seconds in timings.items():
+                    stage_timings.setdefault(stage, []).append(seconds)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        elapsed = time.perf_counter() - start
+
+        return {
+            "queries": len(queries),
+            "concurrency": self.concurrency,
+            "limits": limits,
+            "throughput_qps": len(queries) / elapsed,
+            "stages": {
+                stage: summarize(seconds)
+                for stage, seconds in sorted(stage_timings.items())
+            },
+            "components": await self._time_components(
+                server.client, queries, limits
+            ),
+        }
+
+    async def _time_components(
+        self, engine: InMemorySearchEngine, queries: List[str], limits: dict
+    ) -> Dict[str, Dict[str, float]]:
+        """Times the dedupe, hierarchical and PageRank steps of each query in isolation"""
+        timings: Dict[str, List[float]] = {
+            "select_top_urls": [],
+            "hierarchical_similarity_reranking": [],
+            "pagerank_reranking": [],
+        }
+        for query in queries:
+            query_vector = await engine.get_query_vector(query)
+            broad_results = (
+                await engine.similarity_search(
+                    query_vector, limit=limits["limit_broad_results"]
+                )
+            ).to_results()
+
+            start = time.perf_counter()
+            urls = select_top_urls(
+                broad_results, max_urls=limits["limit_deduped_url_results"]
+            )
+            timings["select_top_urls"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            hierarchical_results = (
+                await engine.hierarchical_similarity_reranking(
+                    query_vector,
+                    urls,
+                    limit=limits["limit_hierarchical_url_results"],
+                )
+            )
+            timings["hierarchical_similarity_reranking"].append(
+                time.perf_counter() - start
+            )
+
+            start = time.perf_counter()
+            engine.pagerank_reranking(
+                hierarchical_results,
+                limit=limits["limit_final_pagerank_results"],
+            )
+            timings["pagerank_reranking"].append(time.perf_counter() - start)
+        return {
+            component: summarize(seconds)
+            for component, seconds in timings.items()
+        }
+
+
+def save_baseline(report: dict, path: str):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+def load_baseline(path: str) -> dict:
+    with open(path) as f:
+        baseline = json.load(f)
+    if baseline.get("version") != BASELINE_VERSION:
+        raise ValueError(
+            f"{path} is a version {baseline.get('version')} baseline, expected version {BASELINE_VERSION}."
+        )
+    return baseline
+
+
+def compare_reports(
+    baseline: dict,
+    report: dict,
+    metric: str = "p50_ms",
+    tolerance: float = 0.2,
+    min_delta_ms: float = 0.05,
+) -> List[dict]:
+    """Compares the timings of each run present in both reports.
+
+    A timing regresses when it grew by more than `tolerance` of its baseline
+    and by more than `min_delta_ms`, which keeps sub-millisecond noise out.
+    Returns one row per compared timing, flagged when it regressed.
+    """
+
+    def runs(r):
+        return {
+            (
+                result["corpus_size"],
+                result["preset"],
+                result["concurrency"],
+            ): result
+            for result in r["results"]
+        }
+
+    baseline_runs = runs(baseline)
+    rows = []
+    for key, result in runs(report).items():
+        baseline_result = baseline_runs.get(key)
+        if baseline_result is None:
+            continue
+        for group in ("stages", "components"):
+            for name, summary in result[group].items():
+                baseline_summary = baseline_result[group].get(name)
+                if baseline_summary is None:
+                    continue
+                before, after = baseline_summary[metric], summary[metric]
+                rows.append(
+                    {
+                        "corpus_size": key[0],
+                        "preset": key[1],
+                        "concurrency": key[2],
+                        "timing": name,
+                        "baseline": before,
+                        "current": after,
+                        "ratio": after / before
+                        if before > 0
+                        else float("inf"),
+                        "regressed": after > before * (1 + tolerance)
+                        and after - before > min_delta_ms,
+                    }
+                )
+        before = baseline_result["throughput_qps"]
+        after = result["throughput_qps"]
+        rows.append(
+            {
+                "corpus_size": key[0],
+                "preset": key[1],
+                "concurrency": key[2],
+                "timing": "throughput_qps",
+                "baseline": before,
+                "current": after,
+                "ratio": after / before if before > 0 else float("inf"),
+                "regressed": after < before / (1 + tolerance),
+            }
+        )
+    return rows
+
+
+def format_report(report: dict, metric: Optional[str] = None) -> str:
+    """A plain text table of the timings of each run"""
+    metrics = [metric] if metric else ["mean_ms", "p50_ms", "p95_ms", "p99_ms"]
+    lines = []
+    for result in report["results"]:
+        lines.append(
+            f"== {result['corpus_size']} URLs, {result['preset']} limits, concurrency {result['concurrency']}: "
+            f"{result['throughput_qps']:.1f} queries/s"
+        )
+        lines.append(f"{'timing':<36}" + "".join(f"{m:>10}" for m in metrics))
+        for group in ("stages", "components"):
+            for name, summary in result[group].items():
+                lines.append(
+                    f"{name:<36}"
+                    + "".join(f"{summary[m]:>10.3f}" for m in metrics)
+                )
+    return "\n".join(lines)
+
+
+def format_comparison(rows: List[dict]) -> str:
+    """A plain text table of the compared timings, regressions marked"""
+    lines = [
+        f"{'corpus':>8} {'preset':<8} {'timing':<36}{'baseline':>10}{'current':>10}{'ratio':>8}"
+    ]
+    for row in rows:
+        lines.append(
+            f"{row['corpus_size']:>8} {row['preset']:<8} {row['timing']:<36}"
+            f"{row['baseline']:>10.3f}{row['current']:>10.3f}{row['ratio']:>8.2f}"
+            + ("  REGRESSED" if row["regressed"] else "")
+        )
+    return "\n".join(lines)
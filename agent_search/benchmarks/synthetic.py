@@ -0,0 +1,173 @@
+import csv
+import hashlib
+import json
+import os
+from typing import Any, Dict, List, Sequence, Union
+
+import numpy as np
+
+from agent_search.core.utils import EMBEDDING_VEC_SIZE, encode_embeddings
+from agent_search.search.vector_store import url_payload
+
+WORDS = (
+    "energy field quantum lagrangian motion system model network data "
+    "theory function graph signal learning protein market language city "
+    "history music climate ocean orbit circuit algorithm matrix vector "
+    "equation particle wave cell species river mountain policy contract"
+).split()
+SUFFIXES = ("com", "org", "net", "io", "co.uk")
+SUBDOMAINS = ("", "www.", "blog.", "docs.")
+
+
+def _stable_seed(text: str) -> int:
+    """A seed derived from the text, stable across processes"""
+    return int.from_bytes(
+        hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(),
+        "little",
+    )
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32)
+
+
+class StubEncoder:
+    """A deterministic stand-in for the embedding model.
+
+    Each text is encoded near the center of a topic picked by its hash, so
+    that queries land among the corpus chunks of that topic. Like the model,
+    a single text gives a vector and a list gives a matrix.
+    """
+
+    def __init__(self, topic_centers: np.ndarray, noise: float = 0.5):
+        self.topic_centers = topic_centers
+        self.noise = noise
+
+    def encode(
+        self, sentences: Union[str, Sequence[str]], batch_size: int = 32
+    ) -> np.ndarray:
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        vectors = (
+            np.stack([self._encode_one(sentence) for sentence in sentences])
+            if sentences
+            else np.empty((0, self.topic_centers.shape[1]))
+        )
+        return vectors[0] if single else vectors
+
+    def _encode_one(self, sentence: str) -> np.ndarray:
+        seed = _stable_seed(sentence)
+        rng = np.random.default_rng(seed)
+        center = self.topic_centers[seed % len(self.topic_centers)]
+        return (
+            center
+            + self.noise
+            * rng.standard_normal(len(center))
+            / np.sqrt(len(center))
+        ).astype(np.float32)
+
+
+class SyntheticCorpus:
+    """A generated corpus standing in for the Postgres table and vector collection.
+
+    URLs are spread over topics, whose chunk embeddings cluster around a
+    shared center, and over hosts of a set of ranked domains.
+    """
+
+    def __init__(
+        self,
+        rows: Dict[str, tuple],
+        vectors: np.ndarray,
+        payloads: List[Dict[str, Any]],
+        topic_centers: np.ndarray,
+        domain_ranks: Dict[str, float],
+        seed: int,
+    ):
+        self.rows = rows
+        self.vectors = vectors
+        self.payloads = payloads
+        self.topic_centers = topic_centers
+        self.domain_ranks = domain_ranks
+        self.seed = seed
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @classmethod
+    def generate(
+        cls,
+        num_urls: int,
+        chunks_per_url: int = 4,
+        words_per_chunk: int = 64,
+        num_domains: int = 500,
+        num_topics: int = 64,
+        seed: int = 0,
+    ) -> "SyntheticCorpus":
+        """Generates `num_urls` rows of `chunks_per_url` chunks, indexing the first chunk of each as in the collection"""
+        # The stored embeddings are decoded at the model's dimension
+        dim = EMBEDDING_VEC_SIZE
+        rng = np.random.default_rng(seed)
+        topic_centers = _normalize_rows(rng.standard_normal((num_topics, dim)))
+        domains = [
+            f"site{i}.{SUFFIXES[i % len(SUFFIXES)]}"
+            for i in range(num_domains)
+        ]
+        domain_ranks = {
+            domain: round(float(rank), 2)
+            for domain, rank in zip(
+                domains, rng.uniform(0.0, 10.0, num_domains)
+            )
+        }
+        words = np.array(WORDS)
+
+        rows: Dict[str, tuple] = {}
+        vectors = np.empty((num_urls, dim), dtype=np.float32)
+        payloads = []
+        for i in range(num_urls):
+            topic = int(rng.integers(num_topics))
+            domain = domains[int(rng.integers(num_domains))]
+            subdomain = SUBDOMAINS[int(rng.integers(len(SUBDOMAINS)))]
+            url = f"https://{subdomain}{domain}/topic-{topic}/page-{i}"
+            embeddings = _normalize_rows(
+                topic_centers[topic]
+                + rng.standard_normal((chunks_per_url, dim)) / np.sqrt(dim)
+            )
+            text_chunks = [
+                " ".join(rng.choice(words, words_per_chunk))
+                for _ in range(chunks_per_url)
+            ]
+            rows[url] = (
+                url,
+                f"Page {i} on topic {topic}",
+                json.dumps({"topic": topic}),
+                "synthetic",
+                json.dumps(text_chunks),
+                encode_embeddings(embeddings),
+            )
+            vectors[i] = embeddings[0]
+            payloads.append(url_payload(url, text_chunks[0]))
+        return cls(rows, vectors, payloads, topic_centers, domain_ranks, seed)
+
+    def encoder(self, noise: float = 0.5) -> StubEncoder:
+        return StubEncoder(self.topic_centers, noise)
+
+    def queries(self, num_queries: int) -> List[str]:
+        rng = np.random.default_rng(self.seed + 1)
+        words = np.array(WORDS)
+        return [
+            f"query {i}: " + " ".join(rng.choice(words, 6))
+            for i in range(num_queries)
+        ]
+
+    def write_domain_ranks(self, csv_path: str) -> str:
+        """Writes the ranks in the 'Domain' and 'Open Page Rank' columns of the rank CSV"""
+        os.makedirs(os.path.dirname(csv_path) or ".", exist_ok=True)
+        with open(csv_path, "w", newline="") as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(["Domain", "Open Page Rank"])
+            for domain, rank in self.domain_ranks.items():
+                writer.writerow([domain, rank])
+        return csv_path
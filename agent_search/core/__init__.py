@@ -1,4 +1,4 @@
 from .client import AgentSearchClient
-from .search_types import AgentSearchResult
+from .search_types import AgentSearchResult, AgentSearchStreamEvent
 
-__all__ = ["AgentSearchClient", "AgentSearchResult"]
+__all__ = ["AgentSearchClient", "AgentSearchResult", "AgentSearchStreamEvent"]
@@ -0,0 +1,375 @@
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import unicodedata
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+import numpy as np
+
+from .search_types import AgentSearchResult
+
+logger = logging.getLogger(__name__)
+
+
+def sizeof(value: Any) -> int:
+    """Approximate the memory footprint of a cached value in bytes"""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """A thread-safe LRU cache bounded by the total byte size of its values, with an optional TTL"""
+
+    def __init__(
+        self,
+        max_bytes: int,
+        ttl: Optional[float] = None,
+        sizeof: Callable[[Any], int] = sizeof,
+    ):
+        self.max_bytes = max_bytes
+        self.ttl = ttl or None
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.resident_bytes = 0
+        # key -> (value, size, expires_at)
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Returns the cached value, or None on a miss or an expired entry"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is not None:
+                if entry[2] <= time.time():
+                    self._remove(key)
+                    entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(
+        self,
+        key: Hashable,
+        value: Any,
+        expires_at: Optional[float] = None,
+    ):
+        """Caches the value, evicting the least recently used entries to fit"""
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        if expires_at is None and self.ttl is not None:
+            expires_at = time.time() + self.ttl
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, expires_at)
+            self.resident_bytes += size
+            while self.resident_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.resident_bytes = 0
+
+    def items(self):
+        """A snapshot of the live (key, value, expires_at) entries, oldest first"""
+        now = time.time()
+        with self._lock:
+            return [
+                (key, value, expires_at)
+                for key, (value, _, expires_at) in self._entries.items()
+                if expires_at is None or expires_at > now
+            ]
+
+    def _remove(self, key: Hashable):
+        _, size, _ = self._entries.pop(key)
+        self.resident_bytes -= size
+
+    def get_stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "resident_bytes": self.resident_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+class EmbeddingCache:
+    """An LRU/TTL cache of query embeddings keyed on the model and the normalized query"""
+
+    def __init__(
+        self,
+        model_name: str,
+        max_bytes: int,
+        ttl: Optional[float] = None,
+        path: Optional[str] = None,
+    ):
+        self.model_name = model_name
+        self.path = path or None
+        self.cache = LRUCache(max_bytes, ttl)
+        if self.path and os.path.exists(self.path):
+            self.load()
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        """Normalizes unicode forms and whitespace, which do not change the embedding"""
+        return " ".join(unicodedata.normalize("NFKC", query).split())
+
+    def get(self, query: str) -> Optional[np.ndarray]:
+        return self.cache.get((self.model_name, self.normalize_query(query)))
+
+    def set(self, query: str, query_vector: np.ndarray):
+        query_vector = np.array(query_vector, dtype=np.float32)
+        query_vector.setflags(write=False)
+        self.cache.set(
+            (self.model_name, self.normalize_query(query)), query_vector
+        )
+
+    def save(self):
+        """Persists the live entries of the cache to disk"""
+        if not self.path:
+            return
+        entries = self.cache.items()
+        entries = [
+            entry for entry in entries if entry[0][0] == self.model_name
+        ]
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                model_name=np.array(self.model_name),
+                queries=np.array([key[1] for key, _, _ in entries], dtype=str),
+                vectors=np.array([value for _, value, _ in entries]),
+                expires_at=np.array(
+                    [
+                        np.nan if expires_at is None else expires_at
+                        for _, _, expires_at in entries
+                    ],
+                    dtype=np.float64,
+                ),
+            )
+        os.replace(tmp_path, self.path)
+        logger.info(f"Saved {len(entries)} query embeddings to {self.path}")
+
+    def load(self):
+        """Warms the cache from disk, skipping entries of another model"""
+        try:
+            with np.load(self.path) as data:
+                if str(data["model_name"]) != self.model_name:
+                    logger.info(
+                        f"Skipping embedding cache at {self.path} built for {data['model_name']}"
+                    )
+                    return
+                for query, vector, expires_at in zip(
+                    data["queries"], data["vectors"], data["expires_at"]
+                ):
+                    if expires_at <= time.time():
+                        continue
+                    vector.setflags(write=False)
+                    self.cache.set(
+                        (self.model_name, str(query)),
+                        vector,
+                        expires_at=None
+                        if np.isnan(expires_at)
+                        else expires_at,
+                    )
+        except Exception as e:
+            logger.error(f"Error {e} while loading embedding cache")
+            return
+        logger.info(
+            f"Loaded {len(self.cache)} query embeddings from {self.path}"
+        )
+
+    def get_stats(self) -> Dict[str, float]:
+        return self.cache.get_stats()
+
+
+class ResultCacheBackend(ABC):
+    """A byte-valued key store which a ResultCache can be backed by"""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[bytes]:
+        pass
+
+    @abstractmethod
+    async def set(self, key: str, value: bytes, ttl: Optional[float]):
+        pass
+
+    @abstractmethod
+    async def clear(self):
+        pass
+
+    def get_stats(self) -> Dict[str, float]:
+        return {}
+
+    async def close(self):
+        pass
+
+
+class InMemoryResultCacheBackend(ResultCacheBackend):
+    """An in-process backend, bounded by the total size of the cached values"""
+
+    def __init__(self, max_bytes: int):
+        self.cache = LRUCache(max_bytes, sizeof=len)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return self.cache.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: Optional[float]):
+        self.cache.set(
+            key, value, expires_at=time.time() + ttl if ttl else None
+        )
+
+    async def clear(self):
+        self.cache.clear()
+
+    def get_stats(self) -> Dict[str, float]:
+        return self.cache.get_stats()
+
+
+class RedisResultCacheBackend(ResultCacheBackend):
+    """A backend for any Redis-compatible server, shared by all server processes.
+
+    Keys are namespaced by a generation counter, so clearing the cache is a
+    single INCR and stale entries age out through their TTL. The size bound is
+    enforced by the server's own `maxmemory` policy.
+    """
+
+    def __init__(self, url: str, namespace: str = "agent_search:results"):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise ImportError(
+                f"Error {e} while importing redis. Please install it with `pip install redis` to use the redis result cache backend."
+            )
+        self.client = redis.from_url(url)
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+
+    async def _generation(self) -> int:
+        return int(await self.client.get(f"{self.namespace}:generation") or 0)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        generation = await self._generation()
+        value = await self.client.get(f"{self.namespace}:{generation}:{key}")
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: Optional[float]):
+        generation = await self._generation()
+        await self.client.set(
+            f"{self.namespace}:{generation}:{key}",
+            value,
+            px=int(ttl * 1_000) if ttl else None,
+        )
+
+    async def clear(self):
+        await self.client.incr(f"{self.namespace}:generation")
+
+    def get_stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    async def close(self):
+        await self.client.close()
+
+
+class ResultCache:
+    """Caches the final results of a search, keyed on the canonicalized request"""
+
+    def __init__(
+        self, backend: ResultCacheBackend, ttl: Optional[float] = None
+    ):
+        self.backend = backend
+        self.ttl = ttl or None
+
+    @classmethod
+    def from_config(cls, config) -> Optional["ResultCache"]:
+        """Builds the cache selected by `result_cache_backend`, or None when disabled"""
+        backend_name = config.get("result_cache_backend", "none")
+        if backend_name == "memory":
+            backend: ResultCacheBackend = InMemoryResultCacheBackend(
+                int(config.get("result_cache_max_bytes", 64 * 1024 * 1024))
+            )
+        elif backend_name == "redis":
+            backend = RedisResultCacheBackend(
+                config.get("result_cache_redis_url", "redis://localhost:6379")
+            )
+        elif backend_name == "none":
+            return None
+        else:
+            raise ValueError(
+                f"Unknown result_cache_backend {backend_name}, expected one of memory, redis or none."
+            )
+        return cls(backend, ttl=float(config.get("result_cache_ttl", 0)))
+
+    @staticmethod
+    def make_key(query: str, **params: Any) -> str:
+        """Hashes the normalized query together with the sorted request parameters"""
+        canonical = {
+            key: sorted(set(value)) if isinstance(value, list) else value
+            for key, value in params.items()
+        }
+        canonical["query"] = EmbeddingCache.normalize_query(query)
+        return hashlib.sha256(
+            json.dumps(canonical, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    async def get(self, key: str) -> Optional[List[AgentSearchResult]]:
+        value = await self.backend.get(key)
+        if value is None:
+            return None
+        # The results were already cleaned when first built, so skip __init__
+        return [
+            AgentSearchResult.construct(**result)
+            for result in json.loads(value)
+        ]
+
+    async def set(self, key: str, results: List[AgentSearchResult]):
+        value = json.dumps([result.dict() for result in results])
+        await self.backend.set(key, value.encode("utf-8"), self.ttl)
+
+    async def invalidate(self):
+        """Drops every cached result, e.g. after the index has been re-populated"""
+        await self.backend.clear()
+        logger.info("Invalidated the search result cache")
+
+    def get_stats(self) -> Dict[str, float]:
+        return self.backend.get_stats()
+
+    async def close(self):
+        await self.backend.close()
@@ -1,9 +1,10 @@
+import json
 import os
-from typing import List, Optional
+from typing import Iterator, List, Optional
 
 import requests
 
-from .search_types import AgentSearchResult
+from .search_types import AgentSearchResult, AgentSearchStreamEvent
 
 
 class AgentSearchClient:
@@ -22,18 +23,24 @@ class AgentSearchClient:
                 "No authorization token provided and SCIPHI_API_KEY environment variable is not set."
             )
 
-    def search(
-        self,
-        query: str,
-        limit_broad_results: int = 1_000,
-        limit_deduped_url_results: int = 100,
-        limit_hierarchical_url_results: int = 25,
-        limit_final_pagerank_results: int = 10,
-    ) -> List[AgentSearchResult]:
-        headers = {
+    def _headers(self) -> dict:
+        return {
             "Authorization": f"Bearer {self.auth_token}",
             "Content-Type": "application/json",
         }
+
+    @staticmethod
+    def _search_payload(
+        query: str,
+        limit_broad_results: int,
+        limit_deduped_url_results: int,
+        limit_hierarchical_url_results: int,
+        limit_final_pagerank_results: int,
+        url_contains_filter: Optional[List[str]],
+        domain_filter: Optional[List[str]],
+        search_profile: Optional[str],
+        hnsw_ef: Optional[int],
+    ) -> dict:
         payload = {
             "query": query,
             "limit_broad_results": limit_broad_results,
@@ -41,8 +48,41 @@ class AgentSearchClient:
             "limit_hierarchical_url_results": limit_hierarchical_url_results,
             "limit_final_pagerank_results": limit_final_pagerank_results,
         }
+        if url_contains_filter:
+            payload["url_contains_filter"] = url_contains_filter
+        if domain_filter:
+            payload["domain_filter"] = domain_filter
+        if search_profile:
+            payload["search_profile"] = search_profile
+        if hnsw_ef:
+            payload["hnsw_ef"] = hnsw_ef
+        return payload
+
+    def search(
+        self,
+        query: str,
+        limit_broad_results: int = 1_000,
+        limit_deduped_url_results: int = 100,
+        limit_hierarchical_url_results: int = 25,
+        limit_final_pagerank_results: int = 10,
+        url_contains_filter: Optional[List[str]] = None,
+        domain_filter: Optional[List[str]] = None,
+        search_profile: Optional[str] = None,
+        hnsw_ef: Optional[int] = None,
+    ) -> List[AgentSearchResult]:
+        payload = self._search_payload(
+            query,
+            limit_broad_results,
+            limit_deduped_url_results,
+            limit_hierarchical_url_results,
+            limit_final_pagerank_results,
+            url_contains_filter,
+            domain_filter,
+            search_profile,
+            hnsw_ef,
+        )
         response = requests.post(
-            f"{self.api_base}/search", headers=headers, json=payload
+            f"{self.api_base}/search", headers=self._headers(), json=payload
         )
         response.raise_for_status()  # Raises an HTTPError if the HTTP request returned an unsuccessful status code
         results = response.json()['results']
@@ -52,3 +92,82 @@ class AgentSearchClient:
         ]
 
         return serp_results
+
+    def search_batch(
+        self,
+        queries: List[str],
+        limit_broad_results: int = 1_000,
+        limit_deduped_url_results: int = 100,
+        limit_hierarchical_url_results: int = 25,
+        limit_final_pagerank_results: int = 10,
+        url_contains_filter: Optional[List[str]] = None,
+        domain_filter: Optional[List[str]] = None,
+        search_profile: Optional[str] = None,
+        hnsw_ef: Optional[int] = None,
+    ) -> List[List[AgentSearchResult]]:
+        """Runs several queries with the same parameters in one request, returning the results of each in order"""
+        payload = {
+            "queries": [
+                self._search_payload(
+                    query,
+                    limit_broad_results,
+                    limit_deduped_url_results,
+                    limit_hierarchical_url_results,
+                    limit_final_pagerank_results,
+                    url_contains_filter,
+                    domain_filter,
+                    search_profile,
+                    hnsw_ef,
+                )
+                for query in queries
+            ]
+        }
+        response = requests.post(
+            f"{self.api_base}/search/batch",
+            headers=self._headers(),
+            json=payload,
+        )
+        response.raise_for_status()
+        return [
+            [AgentSearchResult.from_dict(result) for result in results]
+            for results in response.json()["results"]
+        ]
+
+    def search_stream(
+        self,
+        query: str,
+        limit_broad_results: int = 1_000,
+        limit_deduped_url_results: int = 100,
+        limit_hierarchical_url_results: int = 25,
+        limit_final_pagerank_results: int = 10,
+        url_contains_filter: Optional[List[str]] = None,
+        domain_filter: Optional[List[str]] = None,
+        search_profile: Optional[str] = None,
+        hnsw_ef: Optional[int] = None,
+    ) -> Iterator[AgentSearchStreamEvent]:
+        """Yields the provisional results of each search stage as soon as the server emits them, ending with the final ones"""
+        payload = self._search_payload(
+            query,
+            limit_broad_results,
+            limit_deduped_url_results,
+            limit_hierarchical_url_results,
+            limit_final_pagerank_results,
+            url_contains_filter,
+            domain_filter,
+            search_profile,
+            hnsw_ef,
+        )
+        with requests.post(
+            f"{self.api_base}/search/stream",
+            headers=self._headers(),
+            json=payload,
+            stream=True,
+        ) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                event = json.loads(line)
+                if "error" in event:
+                    raise RuntimeError(f"Search failed with {event['error']}")
+                yield AgentSearchStreamEvent.from_dict(event)
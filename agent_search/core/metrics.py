@@ -0,0 +1,186 @@
+import functools
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Upper bounds of the latency buckets, in seconds
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+# Upper bounds of the candidate count buckets
+COUNT_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1_000, 2_500, 5_000)
+
+# The stage durations of the request being served, summed over the calls
+# made for it, which become its Server-Timing header
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar(
+    "request_timings", default=None
+)
+
+
+class Histogram:
+    """A labelled histogram with fixed buckets, rendered in the Prometheus text format"""
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float]):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._series: Dict[str, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label: str, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label)
+            if series is None:
+                series = self._series[label] = (
+                    [0] * (len(self.buckets) + 1),
+                    [0.0],
+                )
+            series[0][index] += 1
+            series[1][0] += value
+
+    def render(self, label_name: str) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            series = {
+                label: (list(counts), total[0])
+                for label, (counts, total) in self._series.items()
+            }
+        for label, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(
+                    f'{self.name}_bucket{{{label_name}="{label}",le="{bound}"}} {cumulative}'
+                )
+            cumulative += counts[-1]
+            lines.append(
+                f'{self.name}_bucket{{{label_name}="{label}",le="+Inf"}} {cumulative}'
+            )
+            lines.append(f'{self.name}_sum{{{label_name}="{label}"}} {total}')
+            lines.append(
+                f'{self.name}_count{{{label_name}="{label}"}} {cumulative}'
+            )
+        return lines
+
+
+class Metrics:
+    """Per-stage latencies and candidate counts of the search pipeline.
+
+    Timings go to a histogram per stage, and are also summed into the
+    timings of the current request when one is being collected. Disabling
+    the metrics turns every timer into a no-op.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.latencies = Histogram(
+            "agent_search_stage_seconds",
+            "Latency of each search stage.",
+            LATENCY_BUCKETS,
+        )
+        self.counts = Histogram(
+            "agent_search_stage_candidates",
+            "Number of candidates produced by each search stage.",
+            COUNT_BUCKETS,
+        )
+
+    def observe(self, stage: str, seconds: float):
+        self.latencies.observe(stage, seconds)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + seconds
+
+    def count(self, stage: str, candidates: int):
+        if self.enabled:
+            self.counts.observe(stage, candidates)
+
+    @contextmanager
+    def timer(self, stage: str) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def timed(self, stage: str):
+        """Decorates a function or coroutine function to time each call as `stage`"""
+
+        def decorator(func):
+            if inspect.iscoroutinefunction(func):
+
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    if not self.enabled:
+                        return await func(*args, **kwargs)
+                    start = time.perf_counter()
+                    try:
+                        return await func(*args, **kwargs)
+                    finally:
+                        self.observe(stage, time.perf_counter() - start)
+
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(stage, time.perf_counter() - start)
+
+            return wrapper
+
+        return decorator
+
+    @contextmanager
+    def request_timings(self) -> Iterator[Dict[str, float]]:
+        """Collects the stage timings of the calls made within, including those of tasks and threads started within"""
+        timings: Dict[str, float] = {}
+        token = _request_timings.set(timings)
+        try:
+            yield timings
+        finally:
+            _request_timings.reset(token)
+
+    def render(self) -> str:
+        """The histograms in the Prometheus text exposition format"""
+        lines = self.latencies.render("stage") + self.counts.render("stage")
+        return "\n".join(lines) + "\n"
+
+
+def format_server_timing(timings: Dict[str, float]) -> str:
+    """Formats stage timings as a Server-Timing header value, in milliseconds"""
+    return ", ".join(
+        f"{stage};dur={seconds * 1_000.0:.2f}"
+        for stage, seconds in timings.items()
+    )
+
+
+# The registry shared by the engine and the server
+METRICS = Metrics()
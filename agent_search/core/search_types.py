@@ -1,4 +1,4 @@
-from typing import Any, Optional
+from typing import Any, List, Optional
 
 from pydantic import BaseModel
 
@@ -34,3 +34,22 @@ class AgentSearchResult(BaseModel):
     @classmethod
     def from_dict(cls, data: dict):
         return cls(**data)
+
+
+class AgentSearchStreamEvent(BaseModel):
+    """The results of one stage of a streamed search"""
+
+    stage: str
+    final: bool
+    results: List[AgentSearchResult]
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(
+            stage=data["stage"],
+            final=data["final"],
+            results=[
+                AgentSearchResult.from_dict(result)
+                for result in data["results"]
+            ],
+        )
@@ -1,39 +1,55 @@
 import configparser
 import os
-from typing import List, Optional
+from typing import Iterable, Iterator, List, Optional, Tuple
 
 import numpy as np
 
 from agent_search.core import AgentSearchResult
 
+EMBEDDING_VEC_SIZE = 768
+
+# Header marking chunk embeddings stored L2-normalized as float16, rows
+# without it hold raw float32 embeddings
+NORMALIZED_FP16_MAGIC = b"\x93ASFP16\x01"
+
 
 def select_top_urls(
     ordered_points: List[AgentSearchResult],
     max_urls: int = 10,
     url_contains: Optional[List[str]] = None,
 ) -> List[str]:
-    """A function to return the top unique URLs from the given poitns results."""
+    """A function to return the top unique URLs from the given points results, in score order."""
+    return list(
+        iter_top_urls(
+            (point.url for point in ordered_points),
+            max_urls=max_urls,
+            url_contains=url_contains,
+        )
+    )
+
+
+def iter_top_urls(
+    ordered_urls: Iterable[str],
+    max_urls: int = 10,
+    url_contains: Optional[List[str]] = None,
+) -> Iterator[str]:
+    """Lazily yields the top unique URLs, in score order, from the given URLs."""
     if not url_contains:
         url_contains = []
 
-    top_urls = set([])
-    for point in ordered_points:
-        url = point.url
-        if url in top_urls:
+    seen_urls = set()
+    for url in ordered_urls:
+        if url in seen_urls:
             continue
-        url_contains_match = False if url_contains else True
-        for url_contain in url_contains:
-            if url_contain in url:
-                url_contains_match = True
-                break
-        if not url_contains_match:
+        if url_contains and not any(
+            url_contain in url for url_contain in url_contains
+        ):
             continue
-        top_urls.add(point.url)
-        if len(top_urls) >= max_urls:
+        seen_urls.add(url)
+        yield url
+        if len(seen_urls) >= max_urls:
             break
 
-    return list(top_urls)
-
 
 def cosine_similarity(v1: np.ndarray, v2: np.ndarray) -> float:
     """Compute the cosine similarity between two vectors."""
@@ -43,6 +59,78 @@ def cosine_similarity(v1: np.ndarray, v2: np.ndarray) -> float:
     return dot_product / (norm_v1 * norm_v2)
 
 
+def normalize_vector(v: np.ndarray) -> np.ndarray:
+    """Return the L2-normalized copy of a vector as float32."""
+    v = np.asarray(v, dtype=np.float32).ravel()
+    norm = np.linalg.norm(v)
+    return v / norm if norm > 0 else v
+
+
+def stack_embeddings(
+    embeddings: List[np.ndarray],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Stack per-URL embedding matrices into one contiguous matrix.
+
+    Returns the stacked matrix and the start offset of each URL segment.
+    """
+    lengths = np.fromiter(
+        (len(e) for e in embeddings), dtype=np.int64, count=len(embeddings)
+    )
+    offsets = np.zeros(len(embeddings), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=offsets[1:])
+    matrix = np.ascontiguousarray(np.concatenate(embeddings), dtype=np.float32)
+    return matrix, offsets
+
+
+def segmented_argmax(
+    scores: np.ndarray, offsets: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Find the max score and its in-segment index for each non-empty segment."""
+    segment_max = np.maximum.reduceat(scores, offsets)
+    lengths = np.diff(np.append(offsets, len(scores)))
+    segment_ids = np.repeat(np.arange(len(offsets)), lengths)
+    positions = np.arange(len(scores))
+    candidates = np.where(
+        scores == segment_max[segment_ids], positions, len(scores)
+    )
+    argmax = np.minimum.reduceat(candidates, offsets) - offsets
+    return segment_max, argmax
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Return the indices of the `k` largest scores in descending order."""
+    if k <= 0 or len(scores) == 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def encode_embeddings(embeddings: np.ndarray) -> bytes:
+    """Serializes chunk embeddings as L2-normalized float16 for storage."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return NORMALIZED_FP16_MAGIC + (embeddings / norms).astype("<f2").tobytes()
+
+
+def decode_embeddings(embeddings_binary: bytes) -> Tuple[np.ndarray, bool]:
+    """Deserializes stored chunk embeddings, detecting the storage format.
+
+    Returns the embedding matrix and whether its rows are already normalized.
+    """
+    header = bytes(memoryview(embeddings_binary)[: len(NORMALIZED_FP16_MAGIC)])
+    if header == NORMALIZED_FP16_MAGIC:
+        embeddings = np.frombuffer(
+            embeddings_binary, dtype="<f2", offset=len(NORMALIZED_FP16_MAGIC)
+        )
+        return embeddings.reshape(-1, EMBEDDING_VEC_SIZE), True
+    embeddings = np.frombuffer(embeddings_binary, dtype=np.float32)
+    return embeddings.reshape(-1, EMBEDDING_VEC_SIZE), False
+
+
 def get_data_path() -> str:
     return os.path.join(
         os.path.dirname(__file__),
@@ -0,0 +1,83 @@
+"""A script to benchmark the search pipeline on synthetic corpora, saving and comparing baselines."""
+import asyncio
+import logging
+
+import fire
+
+from agent_search.benchmarks.pipeline import (
+    PipelineBenchmark,
+    compare_reports,
+    format_comparison,
+    format_report,
+    load_baseline,
+    save_baseline,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class BenchmarkPipeline:
+    def run(
+        self,
+        corpus_sizes=(1_000, 10_000),
+        presets=("small", "default", "large"),
+        num_queries=200,
+        warm_up_queries=10,
+        concurrency=1,
+        chunks_per_url=4,
+        fetch_latency_ms=0.0,
+        seed=0,
+        output_path=None,
+        baseline_path=None,
+        tolerance=0.2,
+    ):
+        """Runs the benchmark, saving the report to `output_path` and comparing it to `baseline_path`.
+
+        Exits with a non-zero status when a timing regressed by more than
+        `tolerance` against the baseline.
+        """
+        benchmark = PipelineBenchmark(
+            corpus_sizes=_as_tuple(corpus_sizes),
+            presets=_as_tuple(presets),
+            num_queries=num_queries,
+            warm_up_queries=warm_up_queries,
+            concurrency=concurrency,
+            chunks_per_url=chunks_per_url,
+            fetch_latency_ms=fetch_latency_ms,
+            seed=seed,
+        )
+        report = asyncio.run(benchmark.run())
+        print(format_report(report))
+        if output_path:
+            save_baseline(report, output_path)
+            logger.info(f"Saved the benchmark report to {output_path}")
+        if baseline_path:
+            self._compare(load_baseline(baseline_path), report, tolerance)
+
+    def compare(self, baseline_path, report_path, tolerance=0.2):
+        """Compares two saved reports, exiting with a non-zero status on regressions"""
+        self._compare(
+            load_baseline(baseline_path), load_baseline(report_path), tolerance
+        )
+
+    @staticmethod
+    def _compare(baseline, report, tolerance):
+        rows = compare_reports(baseline, report, tolerance=tolerance)
+        print(format_comparison(rows))
+        regressions = [row for row in rows if row["regressed"]]
+        if regressions:
+            logger.error(
+                f"{len(regressions)} timings regressed by more than {tolerance:.0%}"
+            )
+            raise SystemExit(1)
+
+
+def _as_tuple(value):
+    """fire passes a single value for a one-element list"""
+    return tuple(value) if isinstance(value, (list, tuple)) else (value,)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    logger.setLevel(logging.INFO)
+    fire.Fire(BenchmarkPipeline)
@@ -0,0 +1,61 @@
+"""A script to build an in-process vector index from the Postgres table."""
+import json
+import logging
+
+import fire
+import numpy as np
+import psycopg2
+
+from agent_search.core.utils import decode_embeddings, load_config
+from agent_search.search.vector_store import LocalVectorStore, url_payload
+
+logger = logging.getLogger(__name__)
+
+
+class BuildLocalIndex:
+    def __init__(self):
+        self.config = load_config()["agent_search"]
+
+    def run(self, path=None, batch_size=10_000, limit=None, build_hnsw=False):
+        """Indexes the first chunk of every URL, as in the Qdrant collection"""
+        path = path or self.config["local_index_path"]
+        if not path:
+            raise ValueError(
+                "Must pass a path or set local_index_path to build a local index."
+            )
+        conn = psycopg2.connect(
+            dbname=self.config["postgres_db"],
+            user=self.config["postgres_user"],
+            password=self.config["postgres_password"],
+            host=self.config["postgres_host"],
+            options="-c client_encoding=UTF8",
+        )
+        query = f"SELECT url, text_chunks, embeddings FROM {self.config['postgres_table_name']}"
+        if limit:
+            query += f" LIMIT {int(limit)}"
+
+        vectors, payloads = [], []
+        with conn.cursor(name="local_index_cursor") as cur:
+            cur.itersize = batch_size
+            cur.execute(query)
+            for url, text_chunks, embeddings_binary in cur:
+                embeddings, _ = decode_embeddings(embeddings_binary)
+                text_chunks = json.loads(text_chunks)
+                if len(embeddings) == 0 or len(text_chunks) == 0:
+                    continue
+                vectors.append(np.asarray(embeddings[0], dtype=np.float32))
+                payloads.append(url_payload(url, text_chunks[0]))
+                if len(payloads) % batch_size == 0:
+                    logger.info(f"Read {len(payloads)} rows...")
+        conn.close()
+
+        LocalVectorStore.build(
+            path, np.stack(vectors), payloads, build_hnsw=build_hnsw
+        )
+        logger.info(f"Wrote a local index of {len(payloads)} URLs to {path}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    logger.setLevel(logging.INFO)
+    fire.Fire(BuildLocalIndex)
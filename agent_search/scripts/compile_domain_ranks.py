@@ -0,0 +1,38 @@
+"""A script to compile the domain rank CSV into a memory-mappable table."""
+import logging
+import os
+
+import fire
+
+from agent_search.core.utils import get_data_path, load_config
+from agent_search.search.domain_ranks import compile_domain_ranks
+
+logger = logging.getLogger(__name__)
+
+
+class CompileDomainRanks:
+    def __init__(self):
+        self.config = load_config()["agent_search"]
+
+    def run(self, csv_path=None, table_path=None):
+        """Compiles `csv_path` into `table_path`, defaulting to the configured paths"""
+        csv_path = (
+            csv_path
+            or self.config["pagerank_file_path"]
+            or os.path.join(get_data_path(), "domain_ranks.csv")
+        )
+        table_path = (
+            table_path
+            or self.config.get("pagerank_table_path")
+            or os.path.join(get_data_path(), "domain_ranks.bin")
+        )
+        count = compile_domain_ranks(csv_path, table_path)
+        logger.info(
+            f"Compiled {count} domain ranks from {csv_path} into {table_path}"
+        )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    logger.setLevel(logging.INFO)
+    fire.Fire(CompileDomainRanks)
@@ -0,0 +1,45 @@
+"""A script to compile the id to URL map of the Qdrant points from the Postgres table."""
+import logging
+import os
+
+import fire
+import psycopg2
+
+from agent_search.core.utils import get_data_path, load_config
+from agent_search.search.url_ids import compile_url_id_map
+
+logger = logging.getLogger(__name__)
+
+
+class CompileUrlIdMap:
+    def __init__(self):
+        self.config = load_config()["agent_search"]
+
+    def run(self, map_path=None, batch_size=100_000):
+        """Compiles the URL of every row into `map_path`, defaulting to the configured path"""
+        map_path = (
+            map_path
+            or self.config.get("qdrant_url_id_map_path")
+            or os.path.join(get_data_path(), "url_ids.bin")
+        )
+        conn = psycopg2.connect(
+            dbname=self.config["postgres_db"],
+            user=self.config["postgres_user"],
+            password=self.config["postgres_password"],
+            host=self.config["postgres_host"],
+            options="-c client_encoding=UTF8",
+        )
+        with conn.cursor(name="url_id_map_cursor") as cur:
+            cur.itersize = batch_size
+            cur.execute(
+                f"SELECT url FROM {self.config['postgres_table_name']}"
+            )
+            count = compile_url_id_map((row[0] for row in cur), map_path)
+        conn.close()
+        logger.info(f"Compiled the point ids of {count} URLs into {map_path}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    logger.setLevel(logging.INFO)
+    fire.Fire(CompileUrlIdMap)
@@ -0,0 +1,74 @@
+"""A script to export the embedding model to a quantized ONNX model and check it against the original."""
+import json
+import logging
+import os
+
+import fire
+
+from agent_search.core.utils import get_data_path, load_config
+from agent_search.search.embeddings import (
+    OnnxEmbeddingModel,
+    check_equivalence,
+    export_onnx_model,
+)
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_QUERIES = [
+    "What is a lagrangian?",
+    "How do transformers use self-attention?",
+    "Best practices for connection pooling in Postgres",
+    "history of the roman empire",
+    "python asyncio gather vs wait",
+    "symptoms of vitamin d deficiency",
+    "How does INT8 quantization affect model accuracy?",
+    "weather in paris in april",
+]
+
+
+class ExportOnnxEmbeddings:
+    def __init__(self):
+        self.config = load_config()["agent_search"]
+
+    def _output_dir(self, output_dir):
+        return (
+            output_dir
+            or self.config.get("embedding_onnx_path")
+            or os.path.join(get_data_path(), "onnx_embeddings")
+        )
+
+    def run(self, output_dir=None, quantize=True, check=True):
+        """Exports the configured embedding model to `output_dir`, then checks it unless `check` is False"""
+        output_dir = self._output_dir(output_dir)
+        model_path = export_onnx_model(
+            self.config["embedding_model_name"], output_dir, quantize=quantize
+        )
+        logger.info(f"Exported the embedding model to {model_path}")
+        if check:
+            self.check(output_dir, quantized=quantize)
+
+    def check(self, output_dir=None, quantized=True, queries_path=None):
+        """Reports the cosine agreement of the ONNX and PyTorch embeddings, on sample or given queries"""
+        from transformers import AutoModel
+
+        queries = SAMPLE_QUERIES
+        if queries_path:
+            with open(queries_path) as f:
+                queries = [line.strip() for line in f if line.strip()]
+        reference_model = AutoModel.from_pretrained(
+            self.config["embedding_model_name"], trust_remote_code=True
+        )
+        onnx_model = OnnxEmbeddingModel(
+            self._output_dir(output_dir),
+            num_threads=int(self.config.get("embedding_onnx_threads", 0)),
+            quantized=quantized,
+        )
+        agreement = check_equivalence(reference_model, onnx_model, queries)
+        logger.info(f"ONNX embedding agreement: {json.dumps(agreement)}")
+        return agreement
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    logger.setLevel(logging.INFO)
+    fire.Fire(ExportOnnxEmbeddings)
@@ -0,0 +1,63 @@
+"""A script to load test the /search endpoint over a sweep of concurrency levels."""
+import json
+import logging
+from contextlib import nullcontext
+
+import fire
+
+from agent_search.benchmarks.load import (
+    LoadTest,
+    default_query_log_path,
+    format_load_report,
+    local_server,
+    read_query_log,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class LoadTestServer:
+    def run(
+        self,
+        base_url="http://localhost:8000",
+        query_log_path=None,
+        concurrency_levels=(1, 2, 4, 8, 16, 32),
+        duration_seconds=30.0,
+        warm_up_seconds=5.0,
+        timeout=30.0,
+        start_server=False,
+        port=8000,
+        workers=1,
+        output_path=None,
+    ):
+        """Replays the query log against the server at each concurrency level.
+
+        With `start_server` a local server is started on `port` under
+        uvicorn with `workers` processes, and the sweep begins once it is
+        ready. The report is printed and saved to `output_path` as JSON.
+        """
+        queries = read_query_log(query_log_path or default_query_log_path())
+        if not isinstance(concurrency_levels, (list, tuple)):
+            concurrency_levels = (concurrency_levels,)
+        server = (
+            local_server(port=port, workers=workers)
+            if start_server
+            else nullcontext(base_url)
+        )
+        with server as url:
+            report = LoadTest(url, queries, timeout=timeout).sweep(
+                [int(level) for level in concurrency_levels],
+                duration_seconds=duration_seconds,
+                warm_up_seconds=warm_up_seconds,
+            )
+        print(format_load_report(report))
+        if output_path:
+            with open(output_path, "w") as f:
+                json.dump(report, f, indent=2)
+            logger.info(f"Saved the load test report to {output_path}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    logger.setLevel(logging.INFO)
+    fire.Fire(LoadTestServer)
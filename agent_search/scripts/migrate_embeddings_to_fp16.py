@@ -0,0 +1,91 @@
+"""A script to rewrite the stored chunk embeddings as L2-normalized float16, in place."""
+import logging
+
+import fire
+import psycopg2
+from psycopg2.extras import execute_values
+
+from agent_search.core.utils import (
+    decode_embeddings,
+    encode_embeddings,
+    load_config,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class MigrateEmbeddings:
+    def __init__(self):
+        self.config = load_config()["agent_search"]
+
+    def run(self, batch_size=1_000, dry_run=False):
+        """Converts every float32 embeddings row, batch by batch in primary key order.
+
+        Each batch is committed on its own and already converted rows are
+        skipped, so an interrupted migration can simply be run again.
+        """
+        table_name = self.config["postgres_table_name"]
+        primary_key = self.config.get("postgres_primary_key", "id")
+        conn = psycopg2.connect(
+            dbname=self.config["postgres_db"],
+            user=self.config["postgres_user"],
+            password=self.config["postgres_password"],
+            host=self.config["postgres_host"],
+            options="-c client_encoding=UTF8",
+        )
+
+        last_key = None
+        converted, skipped, bytes_before, bytes_after = 0, 0, 0, 0
+        while True:
+            with conn.cursor() as cur:
+                if last_key is None:
+                    cur.execute(
+                        f"SELECT {primary_key}, embeddings FROM {table_name} ORDER BY {primary_key} LIMIT %s",
+                        (batch_size,),
+                    )
+                else:
+                    cur.execute(
+                        f"SELECT {primary_key}, embeddings FROM {table_name} WHERE {primary_key} > %s ORDER BY {primary_key} LIMIT %s",
+                        (last_key, batch_size),
+                    )
+                rows = cur.fetchall()
+                if not rows:
+                    break
+                last_key = rows[-1][0]
+
+                updates = []
+                for key, embeddings_binary in rows:
+                    embeddings, normalized = decode_embeddings(
+                        embeddings_binary
+                    )
+                    if normalized:
+                        skipped += 1
+                        continue
+                    encoded = encode_embeddings(embeddings)
+                    bytes_before += len(embeddings_binary)
+                    bytes_after += len(encoded)
+                    updates.append((key, psycopg2.Binary(encoded)))
+
+                if updates and not dry_run:
+                    execute_values(
+                        cur,
+                        f"UPDATE {table_name} AS t SET embeddings = v.embeddings FROM (VALUES %s) AS v(key, embeddings) WHERE t.{primary_key} = v.key",
+                        updates,
+                    )
+                    conn.commit()
+                converted += len(updates)
+
+            logger.info(
+                f"Converted {converted} rows, skipped {skipped} already converted rows, up to {primary_key} {last_key}"
+            )
+
+        conn.close()
+        logger.info(
+            f"{'Would convert' if dry_run else 'Converted'} {converted} rows, shrinking embeddings from {bytes_before} to {bytes_after} bytes"
+        )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    logger.setLevel(logging.INFO)
+    fire.Fire(MigrateEmbeddings)
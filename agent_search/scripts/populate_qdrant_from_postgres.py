@@ -2,26 +2,34 @@
 import json
 import logging
 import multiprocessing
-import uuid
+import os
+import queue
+import time
 
 import fire
 import numpy as np
 import psycopg2
+import requests
 from qdrant_client import QdrantClient
 from qdrant_client.http import models
 
-from agent_search.core.utils import load_config
+from agent_search.core.utils import (
+    EMBEDDING_VEC_SIZE,
+    decode_embeddings,
+    get_data_path,
+    load_config,
+)
+from agent_search.search.url_ids import point_id
+from agent_search.search.vector_store import url_payload
 
 logger = logging.getLogger(__name__)
 
-EMBEDDING_VEC_SIZE = 768
-
 
 def create_collection(qclient, collection_name):
     qclient.create_collection(
         collection_name=collection_name,
         vectors_config=models.VectorParams(
-            size=768, distance=models.Distance.COSINE
+            size=EMBEDDING_VEC_SIZE, distance=models.Distance.COSINE
         ),
         quantization_config=models.ScalarQuantization(
             scalar=models.ScalarQuantizationConfig(
@@ -31,124 +39,407 @@ def create_collection(qclient, collection_name):
             ),
         ),
     )
+    create_payload_indexes(qclient, collection_name)
 
 
-def process_rows(rows, output_queue):
-    """Process the rows into qdrant point objects."""
-    qdrant_points = []
-    for row in rows:
-        _, url, __, text_chunks, embeddings_binary, ___, ____ = row
-        embeddings = np.frombuffer(
-            embeddings_binary, dtype=np.float32
-        ).reshape(-1, EMBEDDING_VEC_SIZE)
+def create_payload_indexes(qclient, collection_name):
+    """Indexes the payload fields which search filters are pushed down onto.
 
-        text_chunks = json.loads(text_chunks)
-        # Prepare data for Qdrant
-        qdrant_points.append(
-            models.PointStruct(
-                id=str(uuid.uuid3(uuid.NAMESPACE_DNS, url)),
-                vector=[float(ele) for ele in embeddings[0]],
-                payload={"text": text_chunks[0], "url": url},
-            )
+    URL filters are substring checks, which no index answers exactly, so
+    they are applied to the search results and the url is not indexed.
+    """
+    for field_name in ["domain", "host"]:
+        qclient.create_payload_index(
+            collection_name=collection_name,
+            field_name=field_name,
+            field_schema=models.PayloadSchemaType.KEYWORD,
         )
 
-    output_queue.put(qdrant_points)
-
 
-def qdrant_writer(config, qdrant_queue, delete_existing):
-    """A writer that listens for output events in a separate thread."""
-    qclient = QdrantClient(
+def _qdrant_client(config):
+    return QdrantClient(
         config["qdrant_host"],
         port=config["qdrant_grpc_port"],
         prefer_grpc=config["qdrant_prefer_grpc"],
     )
-    if delete_existing:
-        qclient.delete_collection(config["qdrant_collection_name"])
-        create_collection(qclient, config["qdrant_collection_name"])
 
-    logger.info("Launching Qdrant writer")
-    while True:
-        try:
-            points = qdrant_queue.get()
-            logger.info(f"Starting Qdrant write-out...")
-            if points is None:  # Sentinel to end the process
-                break
-            operation_result = qclient.upsert(
-                collection_name=config["qdrant_collection_name"],
-                wait=True,
-                points=points,
-            )
-            logger.info(
-                f"Finished Qdrant write-out with result {operation_result}..."
-            )
-        except Exception as e:
-            logger.info(f"Task failed with {e}")
-
-
-def process_batches(config, start, end, batch_size, output_queue):
-    """Processes the batches in steps of the given batch_size"""
 
-    # Connect to the database
-    conn = psycopg2.connect(
+def _connect_postgres(config):
+    return psycopg2.connect(
         dbname=config["postgres_db"],
         user=config["postgres_user"],
         password=config["postgres_password"],
         host=config["postgres_host"],
         options="-c client_encoding=UTF8",
     )
-    cur = conn.cursor()
-    # Declare a server-side cursor with offset
-    cur.execute(
-        f"DECLARE proc_cursor CURSOR FOR SELECT * FROM {config['postgres_table_name']} OFFSET {start} LIMIT {end - start}"
+
+
+def process_rows(rows):
+    """Process the rows into a batch of point ids, a vector matrix and payloads.
+
+    The vectors stay a NumPy array, which is cheap to pass between processes.
+    """
+    ids, vectors, payloads = [], [], []
+    for row in rows:
+        _, url, text_chunks, embeddings_binary = row
+        embeddings, _ = decode_embeddings(embeddings_binary)
+
+        text_chunks = json.loads(text_chunks)
+        if len(embeddings) == 0 or len(text_chunks) == 0:
+            continue
+        ids.append(point_id(url))
+        vectors.append(embeddings[0])
+        payloads.append(url_payload(url, text_chunks[0]))
+
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(
+        -1, EMBEDDING_VEC_SIZE
     )
+    return ids, vectors, payloads
 
-    offset = start
-    while True:
-        logger.info(
-            f"Fetching a batch of size {batch_size} at offset {offset}"
-        )
-        # Fetch a batch of rows
-        cur.execute(f"FETCH {batch_size} FROM proc_cursor")
-        rows = cur.fetchall()
 
-        if len(rows) == 0:
-            break
+def qdrant_writer(config, qdrant_queue, results_queue, wait, max_retries):
+    """A writer upserting the batches of the queue, several of which run in parallel.
 
-        process_rows(rows, output_queue)
-        offset += batch_size
+    Each batch is retried with a backoff, and its outcome is reported on the
+    results queue, so that only written batches are checkpointed.
+    """
+    qclient = _qdrant_client(config)
 
-        # terminate
-        if offset + batch_size >= end:
+    logger.info("Launching Qdrant writer")
+    while True:
+        batch = qdrant_queue.get()
+        if batch is None:  # Sentinel to end the process
             break
+        partition, after_key, last_key, ids, vectors, payloads = batch
+        for attempt in range(max_retries + 1):
+            try:
+                if ids:
+                    qclient.upsert(
+                        collection_name=config["qdrant_collection_name"],
+                        wait=wait,
+                        # One conversion of the whole matrix, rather than
+                        # one Python float per element
+                        points=models.Batch(
+                            ids=ids,
+                            vectors=vectors.tolist(),
+                            payloads=payloads,
+                        ),
+                    )
+                results_queue.put(
+                    ("written", partition, after_key, last_key, len(ids))
+                )
+                break
+            except Exception as e:
+                if attempt < max_retries:
+                    logger.info(f"Task failed with {e}, retrying...")
+                    time.sleep(2**attempt)
+                    continue
+                logger.error(
+                    f"Batch ({after_key}, {last_key}] of partition {partition} failed permanently with {e}"
+                )
+                results_queue.put(
+                    ("failed", partition, after_key, last_key, str(e))
+                )
+
+
+def process_partitions(
+    config, partition_queue, batch_size, output_queue, results_queue
+):
+    """Reads the primary key ranges of the queue in batches of the given batch_size
+
+    Each batch seeks past the last key of the previous one, so that no rows
+    are scanned twice, however deep into the table the range starts.
+    """
+    table_name = config["postgres_table_name"]
+    primary_key = config.get("postgres_primary_key", "id")
+    conn = _connect_postgres(config)
+    cur = conn.cursor()
+    while True:
+        task = partition_queue.get()
+        if task is None:
+            break
+        partition, after_key, upper_key = task
+        last_key = after_key
+        while True:
+            conditions, params = [], []
+            if last_key is not None:
+                conditions.append(f"{primary_key} > %s")
+                params.append(last_key)
+            if upper_key is not None:
+                conditions.append(f"{primary_key} <= %s")
+                params.append(upper_key)
+            where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+            logger.info(
+                f"Fetching a batch of size {batch_size} of partition {partition} after {primary_key} {last_key}"
+            )
+            cur.execute(
+                f"SELECT {primary_key}, url, text_chunks, embeddings FROM {table_name} {where}ORDER BY {primary_key} LIMIT %s",
+                (*params, batch_size),
+            )
+            rows = cur.fetchall()
+            if not rows:
+                break
+
+            batch_last_key = rows[-1][0]
+            # Blocks while the queue is full, so readers wait on the writers
+            output_queue.put(
+                (partition, last_key, batch_last_key, *process_rows(rows))
+            )
+            last_key = batch_last_key
+            if len(rows) < batch_size:
+                break
+        results_queue.put(("read", partition, last_key, None, None))
 
     cur.close()
     conn.close()
 
 
+def compute_partitions(config, num_partitions):
+    """Splits the primary keys into ranges of about equal row counts.
+
+    Returns (lower, upper) bounds, exclusive and inclusive respectively, with
+    None leaving the first and last range open.
+    """
+    primary_key = config.get("postgres_primary_key", "id")
+    fractions = [i / num_partitions for i in range(1, num_partitions)]
+    conn = _connect_postgres(config)
+    with conn.cursor() as cur:
+        cur.execute(
+            f"SELECT percentile_disc(%s::float8[]) WITHIN GROUP (ORDER BY {primary_key}) FROM {config['postgres_table_name']}",
+            (fractions,),
+        )
+        bounds = cur.fetchone()[0] or []
+    conn.close()
+    bounds = sorted(set(bound for bound in bounds if bound is not None))
+    return list(zip([None] + bounds, bounds + [None]))
+
+
+class PopulationCheckpoint:
+    """The progress of each primary key range, persisted as JSON.
+
+    The last key of a range only advances past batches which were written,
+    or failed permanently, in key order, so a resumed run rewrites at most
+    the batches in flight when the previous one stopped. Upserts are keyed
+    by URL, so rewriting them is harmless.
+    """
+
+    def __init__(self, path, source, partitions):
+        self.path = path
+        self.source = source
+        self.partitions = partitions
+        self.failed_batches = []
+        # Batches written ahead of an earlier batch still in flight, by the
+        # key they start after
+        self.completed = [{} for _ in partitions]
+        self.read_until = [None] * len(partitions)
+        self.rows_written = 0
+
+    @classmethod
+    def create(cls, path, source, bounds):
+        partitions = [
+            {"lower": lower, "upper": upper, "last_key": lower, "done": False}
+            for lower, upper in bounds
+        ]
+        return cls(path, source, partitions)
+
+    @classmethod
+    def resume(cls, path, source):
+        """Loads the checkpoint at `path`, turning its failed batches into ranges to retry"""
+        with open(path) as f:
+            state = json.load(f)
+        if state["source"] != source:
+            raise ValueError(
+                f"The checkpoint at {path} is of {state['source']}, not {source}. Pass restart=True to start over."
+            )
+        partitions = [p for p in state["partitions"] if not p["done"]]
+        partitions.extend(
+            {
+                "lower": batch["after_key"],
+                "upper": batch["last_key"],
+                "last_key": batch["after_key"],
+                "done": False,
+            }
+            for batch in state["failed_batches"]
+        )
+        return cls(path, source, partitions)
+
+    def pending(self):
+        """The (partition, after key, upper key) of every range left to read"""
+        return [
+            (i, partition["last_key"], partition["upper"])
+            for i, partition in enumerate(self.partitions)
+            if not partition["done"]
+        ]
+
+    def record(self, outcome, partition, after_key, last_key, detail):
+        if outcome == "read":
+            # Wrapped, as a range without rows is read until the key None
+            self.read_until[partition] = (after_key,)
+        else:
+            if outcome == "written":
+                self.rows_written += detail
+            else:
+                self.failed_batches.append(
+                    {
+                        "partition": partition,
+                        "after_key": after_key,
+                        "last_key": last_key,
+                        "error": detail,
+                    }
+                )
+            self.completed[partition][after_key] = last_key
+        state, completed = (
+            self.partitions[partition],
+            self.completed[partition],
+        )
+        while state["last_key"] in completed:
+            state["last_key"] = completed.pop(state["last_key"])
+        if self.read_until[partition] == (state["last_key"],):
+            state["done"] = True
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "source": self.source,
+                    "partitions": self.partitions,
+                    "failed_batches": self.failed_batches,
+                },
+                f,
+                indent=2,
+            )
+        os.replace(tmp_path, self.path)
+
+    def report(self):
+        """Logs the ranges left unfinished and the batches which failed permanently"""
+        unfinished = [p for p in self.partitions if not p["done"]]
+        for partition in unfinished:
+            logger.error(
+                f"Range ({partition['lower']}, {partition['upper']}] is unfinished, stopped after {partition['last_key']}"
+            )
+        for batch in self.failed_batches:
+            logger.error(
+                f"Batch ({batch['after_key']}, {batch['last_key']}] failed permanently with {batch['error']}"
+            )
+        logger.info(
+            f"Wrote {self.rows_written} rows, {len(self.partitions) - len(unfinished)}/{len(self.partitions)} ranges finished, "
+            f"{len(self.failed_batches)} batches failed permanently"
+        )
+        return not unfinished and not self.failed_batches
+
+
+def collect_results(
+    checkpoint,
+    results_queue,
+    processes,
+    total_count,
+    report_interval,
+    writers=None,
+):
+    """Records the batch outcomes until the processes exit, logging the rows written per second.
+
+    The checkpoint is saved at each report. Raises when every writer has
+    died while the processes are still running, as they would otherwise
+    block on the full queue forever.
+    """
+    started_at = last_at = time.monotonic()
+    last_rows = checkpoint.rows_written
+    while True:
+        alive = any(proc.is_alive() for proc in processes)
+        try:
+            checkpoint.record(*results_queue.get(timeout=1))
+        except queue.Empty:
+            if not alive:
+                break
+        now, rows = time.monotonic(), checkpoint.rows_written
+        if now - last_at >= report_interval:
+            logger.info(
+                f"Wrote {rows}/{total_count} rows, {(rows - last_rows) / (now - last_at):.0f} rows/sec "
+                f"({rows / (now - started_at):.0f} rows/sec overall)"
+            )
+            checkpoint.save()
+            last_at, last_rows = now, rows
+        if (
+            writers is not None
+            and not any(writer.is_alive() for writer in writers)
+            and any(proc.is_alive() for proc in processes)
+        ):
+            raise RuntimeError("All Qdrant writers exited unexpectedly.")
+
+
 class PopulateQdrant:
     def __init__(self):
         self.config = load_config()["agent_search"]
 
-    def run(self, num_processes=16, batch_size=1_024, delete_existing=False):
-        """Runs the population process for the qdrant database"""
-        qdrant_queue = multiprocessing.Queue()
-        qdrant_writer_thread = multiprocessing.Process(
-            target=qdrant_writer,
-            args=(
-                self.config,
-                qdrant_queue,
-                delete_existing,
-            ),
+    def run(
+        self,
+        num_processes=16,
+        batch_size=1_024,
+        delete_existing=False,
+        invalidate_cache_url=None,
+        invalidate_cache_token=None,
+        num_writers=4,
+        queue_size=None,
+        wait=True,
+        report_interval=10,
+        num_partitions=None,
+        checkpoint_path=None,
+        restart=False,
+        max_retries=3,
+    ):
+        """Runs the population process for the qdrant database
+
+        The table is split up front into `num_partitions` primary key ranges,
+        four per process by default, which the processes read in key order.
+        Progress is checkpointed to `checkpoint_path`, and a run finding a
+        checkpoint resumes from it, retrying the batches which failed
+        permanently before. Pass `restart` to start over. The checkpoint is
+        removed once every range has been written without failures.
+
+        Readers hand batches to `num_writers` parallel writers through a queue
+        of at most `queue_size` batches, twice the writers by default, and
+        block while it is full. Without `wait` the writers do not wait for
+        Qdrant to apply each upsert, so the last points may land just after
+        the run returns.
+
+        Pass the base URL of a running search server as `invalidate_cache_url`
+        to drop its cached results once the population has finished. The
+        request carries `invalidate_cache_token`, by default the server's
+        cache_invalidate_token setting.
+        """
+        checkpoint_path = (
+            checkpoint_path
+            or self.config.get("qdrant_populate_checkpoint_path")
+            or os.path.join(get_data_path(), "populate_qdrant_checkpoint.json")
         )
-        qdrant_writer_thread.start()
-
-        conn = psycopg2.connect(
-            dbname=self.config["postgres_db"],
-            user=self.config["postgres_user"],
-            password=self.config["postgres_password"],
-            host=self.config["postgres_host"],
-            options="-c client_encoding=UTF8",
+        source = (
+            f"{self.config['postgres_table_name']}.{self.config.get('postgres_primary_key', 'id')}"
+            f" -> {self.config['qdrant_collection_name']}"
         )
+        if delete_existing:
+            qclient = _qdrant_client(self.config)
+            qclient.delete_collection(self.config["qdrant_collection_name"])
+            create_collection(qclient, self.config["qdrant_collection_name"])
+
+        if os.path.exists(checkpoint_path) and not (
+            restart or delete_existing
+        ):
+            checkpoint = PopulationCheckpoint.resume(checkpoint_path, source)
+            logger.info(
+                f"Resuming {len(checkpoint.pending())} ranges from the checkpoint at {checkpoint_path}"
+            )
+        else:
+            checkpoint = PopulationCheckpoint.create(
+                checkpoint_path,
+                source,
+                compute_partitions(
+                    self.config, num_partitions or 4 * num_processes
+                ),
+            )
+        checkpoint.save()
+
+        conn = _connect_postgres(self.config)
         cur = conn.cursor()
 
         # Count total number of entries
@@ -156,40 +447,105 @@ class PopulateQdrant:
             f"SELECT COUNT(*) FROM {self.config['postgres_table_name']}"
         )
         total_count = cur.fetchone()[0]
+        cur.close()
+        conn.close()
         logger.info(
-            f"Processing {total_count} entries in {num_processes} processes"
+            f"Processing {total_count} entries in {len(checkpoint.pending())} ranges, with {num_processes} processes and {num_writers} writers"
         )
 
-        range_size = total_count // num_processes
+        qdrant_queue = multiprocessing.Queue(
+            maxsize=queue_size or 2 * num_writers
+        )
+        results_queue = multiprocessing.Queue()
+        partition_queue = multiprocessing.Queue()
+        for task in checkpoint.pending():
+            partition_queue.put(task)
+        for _ in range(num_processes):
+            partition_queue.put(None)
+
+        writers = []
+        for i in range(num_writers):
+            writer = multiprocessing.Process(
+                target=qdrant_writer,
+                args=(
+                    self.config,
+                    qdrant_queue,
+                    results_queue,
+                    wait,
+                    max_retries,
+                ),
+            )
+            writers.append(writer)
+            writer.start()
 
         # Create and start multiprocessing workflow
         processes = []
         for i in range(num_processes):
             logger.info(f"Starting process {i}...")
-            start = i * range_size
-            end = start + range_size if i < num_processes - 1 else total_count
             proc = multiprocessing.Process(
-                target=process_batches,
+                target=process_partitions,
                 args=(
                     self.config,
-                    start,
-                    end,
+                    partition_queue,
                     batch_size,
                     qdrant_queue,
+                    results_queue,
                 ),
             )
             processes.append(proc)
             proc.start()
 
-        # Wait for all processes to finish
-        for proc in processes:
-            proc.join()
+        try:
+            # Wait for all processes to finish
+            collect_results(
+                checkpoint,
+                results_queue,
+                processes,
+                total_count,
+                report_interval,
+                writers,
+            )
 
-        # send termination signal
-        qdrant_queue.put(None)
+            # send a termination signal to each writer
+            for _ in writers:
+                qdrant_queue.put(None)
+            collect_results(
+                checkpoint,
+                results_queue,
+                writers,
+                total_count,
+                report_interval,
+            )
+        finally:
+            checkpoint.save()
+
+        if checkpoint.report():
+            os.remove(checkpoint_path)
+        else:
+            logger.error(
+                f"Run again to resume from the checkpoint at {checkpoint_path}"
+            )
 
-        cur.close()
-        conn.close()
+        if invalidate_cache_url:
+            token = invalidate_cache_token or load_config()["server"].get(
+                "cache_invalidate_token", ""
+            )
+            response = requests.post(
+                f"{invalidate_cache_url}/cache/invalidate",
+                headers={"X-Admin-Token": token},
+            )
+            response.raise_for_status()
+            logger.info(
+                f"Invalidated the result cache at {invalidate_cache_url}"
+            )
+
+    def create_indexes(self):
+        """Creates the payload indexes on an existing collection, which filters need to be fast"""
+        qclient = _qdrant_client(self.config)
+        create_payload_indexes(qclient, self.config["qdrant_collection_name"])
+        logger.info(
+            f"Created payload indexes on {self.config['qdrant_collection_name']}"
+        )
 
 
 if __name__ == "__main__":
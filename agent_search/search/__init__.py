@@ -1,3 +1,22 @@
+from .async_base import AsyncWebSearchEngine
 from .base import WebSearchEngine
+from .precision import SearchPrecision, SearchProfiles
+from .vector_store import (
+    LocalVectorStore,
+    QdrantVectorStore,
+    SearchFilter,
+    VectorSearch,
+    VectorStore,
+)
 
-__all__ = ["WebSearchEngine"]
+__all__ = [
+    "AsyncWebSearchEngine",
+    "LocalVectorStore",
+    "QdrantVectorStore",
+    "SearchFilter",
+    "SearchPrecision",
+    "SearchProfiles",
+    "VectorSearch",
+    "VectorStore",
+    "WebSearchEngine",
+]
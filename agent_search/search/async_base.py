@@ -0,0 +1,243 @@
+import asyncio
+import logging
+import time
+from typing import Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from agent_search.core.metrics import METRICS
+
+from .base import WebSearchEngine
+from .postgres import PoolStats, fetch_urls_query, record_degraded_fetch
+from .precision import SearchPrecision
+from .records import UrlRecord
+from .result_batch import ResultBatch
+from .vector_store import SearchFilter, VectorSearch, VectorStore
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncWebSearchEngine(WebSearchEngine):
+    """An asyncio variant of the WebSearchEngine, backed by the async vector store client and asyncpg"""
+
+    def __init__(self, vector_store: Optional[VectorStore] = None):
+        try:
+            import asyncpg  # noqa: F401
+        except ImportError as e:
+            raise ImportError(
+                f"Error {e} while importing asyncpg. Please install it with `pip install asyncpg` to run an AsyncWebSearchEngine instance."
+            )
+        super().__init__(vector_store)
+
+    def _load_postgres_pool(self):
+        """The asyncpg pool needs a running event loop, so it is opened in `connect`"""
+        self.pool_stats = PoolStats(
+            int(self.config.get("postgres_pool_max_size", 8))
+        )
+        self.pool_timeout = float(self.config.get("postgres_pool_timeout", 10))
+        return None
+
+    def _connect_vector_store(self):
+        """The async vector store connections are opened in `connect`"""
+
+    async def connect(self):
+        """Connects the vector store and opens the Postgres connection pool"""
+        import asyncpg
+
+        await self.vector_store.aconnect()
+        # asyncpg discards broken connections on release, and idle ones are
+        # recycled after the health check interval
+        self.pool = await asyncpg.create_pool(
+            database=self.config["postgres_db"],
+            user=self.config["postgres_user"],
+            password=self.config["postgres_password"],
+            host=self.config["postgres_host"],
+            min_size=int(self.config.get("postgres_pool_min_size", 1)),
+            max_size=self.pool_stats.max_size,
+            max_inactive_connection_lifetime=float(
+                self.config.get("postgres_pool_health_check_interval", 30)
+            ),
+            server_settings={"client_encoding": "UTF8"},
+        )
+
+    async def close(self):
+        """Persists the embedding cache and closes the Postgres pool and vector store"""
+        if self.embedding_batcher is not None:
+            self.embedding_batcher.close()
+        if self.embedding_cache is not None:
+            self.embedding_cache.save()
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+        await self.vector_store.aclose()
+
+    @METRICS.timed("embed")
+    async def get_query_vector(self, query: str):
+        """Gets the query vector for the given query, encoding off the event loop"""
+        if self.embedding_cache is not None:
+            query_vector = self.embedding_cache.get(query)
+            if query_vector is not None:
+                return query_vector
+
+        if self.embedding_batcher is not None:
+            query_vector = await asyncio.wrap_future(
+                self.embedding_batcher.submit(query)
+            )
+        else:
+            query_vector = await asyncio.to_thread(
+                self.embedding_model.encode, query
+            )
+        if self.embedding_cache is not None:
+            self.embedding_cache.set(query, query_vector)
+        return query_vector
+
+    @METRICS.timed("embed")
+    async def get_query_vectors(self, queries: List[str]) -> np.ndarray:
+        """Gets the query vectors of a batch of queries, encoding every cache miss in one forward pass off the event loop"""
+        query_vectors, missing_queries = self._cached_query_vectors(queries)
+        encoded = (
+            await asyncio.to_thread(self.encode_queries, missing_queries)
+            if missing_queries
+            else []
+        )
+        return self._fill_query_vectors(
+            queries, query_vectors, missing_queries, encoded
+        )
+
+    @METRICS.timed("vector_search")
+    async def similarity_search(
+        self,
+        query_vector: np.ndarray,
+        limit: int = 100,
+        search_filter: Optional[SearchFilter] = None,
+        payload_fields: Optional[Sequence[str]] = None,
+        precision: Optional[SearchPrecision] = None,
+    ) -> ResultBatch:
+        """Searches the collection for the given query and returns the top 'limit' results matching the filter
+
+        Pass `broad_payload_fields` as `payload_fields` when only the URLs of the results are used.
+        """
+
+        points = await self.vector_store.asearch(
+            query_vector,
+            limit=limit,
+            search_filter=search_filter,
+            payload_fields=payload_fields,
+            precision=precision,
+        )
+        return ResultBatch.from_hits(points)
+
+    @METRICS.timed("vector_search")
+    async def grouped_similarity_search(
+        self,
+        query_vector: np.ndarray,
+        limit: int = 100,
+        search_filter: Optional[SearchFilter] = None,
+        payload_fields: Optional[Sequence[str]] = None,
+        precision: Optional[SearchPrecision] = None,
+    ) -> ResultBatch:
+        """Searches the collection for the best scoring point of each of the top 'limit' distinct URLs"""
+
+        points = await self.vector_store.asearch_groups(
+            query_vector,
+            limit=limit,
+            search_filter=search_filter,
+            payload_fields=payload_fields,
+            precision=precision,
+            group_by="url",
+        )
+        return ResultBatch.from_hits(points)
+
+    async def similarity_search_batch(
+        self, searches: Sequence[VectorSearch], grouped: bool = False
+    ) -> List[ResultBatch]:
+        """Runs several similarity searches in one vector store request, or grouped searches concurrently"""
+        if grouped:
+            return list(
+                await asyncio.gather(
+                    *(
+                        self.grouped_similarity_search(*search)
+                        for search in searches
+                    )
+                )
+            )
+        with METRICS.timer("vector_search"):
+            batch_points = await self.vector_store.asearch_batch(searches)
+        return [ResultBatch.from_hits(points) for points in batch_points]
+
+    @METRICS.timed("postgres_fetch")
+    async def execute_batch_query(self, urls):
+        """Fetches the rows for a single batch of URLs"""
+        start = time.monotonic()
+        try:
+            async with self.pool.acquire(timeout=self.pool_timeout) as conn:
+                self.pool_stats.record_checkout(time.monotonic() - start)
+                logger.info(f"Executing batch query for URLs: {urls[0:2]}")
+                # asyncpg prepares the statement once per connection and
+                # reuses it from its statement cache afterwards
+                rows = await conn.fetch(
+                    fetch_urls_query(self.config["postgres_table_name"]), urls
+                )
+                return [tuple(row) for row in rows]
+        except asyncio.TimeoutError:
+            self.pool_stats.record_timeout()
+            logger.error(
+                f"Timed out after {self.pool_timeout}s waiting for a Postgres connection."
+            )
+        except Exception as e:
+            logger.error(f"Error in execute_batch_query: {e}")
+        record_degraded_fetch()
+        return []
+
+    def get_stats(self) -> dict:
+        """Returns the observable statistics of the engine's components"""
+        size = self.pool.get_size() if self.pool else 0
+        idle = self.pool.get_idle_size() if self.pool else 0
+        stats = {"postgres_pool": self.pool_stats.to_dict(size, idle)}
+        if self.embedding_cache is not None:
+            stats["embedding_cache"] = self.embedding_cache.get_stats()
+        if self.embedding_batcher is not None:
+            stats["embedding_batcher"] = self.embedding_batcher.get_stats()
+        if self.url_record_cache is not None:
+            stats["url_record_cache"] = self.url_record_cache.get_stats()
+        return stats
+
+    async def fetch_url_records(self, urls: List[str]) -> List[UrlRecord]:
+        """Returns the decoded records of the URLs, only querying Postgres for cache misses"""
+        records, missing_urls = self._cached_url_records(urls)
+        if missing_urls:
+            records.extend(
+                self._decode_url_rows(
+                    await self.execute_batch_query(missing_urls)
+                )
+            )
+        return records
+
+    async def hierarchical_similarity_reranking(
+        self,
+        query_vector: np.ndarray,
+        urls: Iterable[str],
+        limit: int = 100,
+    ) -> ResultBatch:
+        """Hierarchical URL search, fetching the records of every URL in one round trip.
+
+        A single fetch holds one pooled connection per request, where
+        concurrent fetches of URL batches would exhaust the pool under load.
+        """
+        records = await self.fetch_url_records(list(urls))
+        METRICS.count("url_records", len(records))
+        return self.rerank_url_records(query_vector, records, limit)
+
+    async def hierarchical_similarity_reranking_batch(
+        self,
+        query_vectors: np.ndarray,
+        url_lists: List[List[str]],
+        limits: List[int],
+    ) -> List[ResultBatch]:
+        """Hierarchical search for several queries, fetching the union of their URLs once"""
+        records = await self.fetch_url_records(
+            list(dict.fromkeys(url for urls in url_lists for url in urls))
+        )
+        return self._rerank_url_record_lists(
+            query_vectors, url_lists, limits, records
+        )
@@ -1,19 +1,36 @@
-import csv
-import json
 import logging
 import os
-from typing import List
+from typing import List, Optional, Sequence, Tuple
 
 import numpy as np
-import psycopg2
-from qdrant_client import QdrantClient
-from transformers import AutoModel
 
-from agent_search.core import AgentSearchResult
+from agent_search.core.cache import EmbeddingCache, LRUCache
+from agent_search.core.metrics import METRICS
 from agent_search.core.utils import (
-    cosine_similarity,
     get_data_path,
     load_config,
+    normalize_vector,
+    segmented_argmax,
+    stack_embeddings,
+)
+from agent_search.search.batching import EmbeddingBatcher
+from agent_search.search.domain_ranks import (
+    DomainResolver,
+    load_domain_ranks,
+    read_public_suffixes,
+)
+from agent_search.search.embeddings import OnnxEmbeddingModel
+from agent_search.search.postgres import (
+    PostgresConnectionPool,
+    record_degraded_fetch,
+)
+from agent_search.search.precision import SearchPrecision, SearchProfiles
+from agent_search.search.records import UrlRecord, decode_url_row
+from agent_search.search.result_batch import ResultBatch
+from agent_search.search.vector_store import (
+    SearchFilter,
+    VectorSearch,
+    VectorStore,
 )
 
 logger = logging.getLogger(__name__)
@@ -24,46 +41,82 @@ class WebSearchEngine:
 
     def __init__(
         self,
+        vector_store: Optional[VectorStore] = None,
     ):
-        try:
-            import psycopg2
-        except ImportError as e:
-            raise ImportError(
-                f"Error {e} while imoprting psycopg2. Please install it with `pip install psycopg2` to run an WebSearchEngine instance."
-            )
-
         # Load config
-        self.config = load_config()["agent_search"]
+        self.config = self._load_config()
 
         # Load Postgres
         logger.info(
             f"Connecting to Postgres database at: {self.config['postgres_db']}."
         )
+        self.pool = self._load_postgres_pool()
 
-        # Load qdrant client
-        logger.info(
-            f"Connecting to collection: {self.config['qdrant_collection_name']}"
+        self.url_record_cache = None
+        url_record_cache_max_bytes = int(
+            self.config.get("url_record_cache_max_bytes", 0)
         )
-        self.qdrant_collection_name = self.config["qdrant_collection_name"]
-        self.client = QdrantClient(
-            self.config["qdrant_host"],
-            grpc_port=self.config["qdrant_grpc_port"],
-            prefer_grpc=True,
+        if url_record_cache_max_bytes > 0:
+            self.url_record_cache = LRUCache(
+                url_record_cache_max_bytes,
+                ttl=float(self.config.get("url_record_cache_ttl", 0)),
+                sizeof=UrlRecord.nbytes,
+            )
+
+        # Load vector store
+        self.vector_store = vector_store or VectorStore.from_config(
+            self.config
         )
-        if not self.client.get_collection(self.qdrant_collection_name):
+        self._connect_vector_store()
+        self.broad_payload_fields = self._load_broad_payload_fields()
+        broad_search_mode = self.config.get("broad_search_mode", "flat")
+        if broad_search_mode not in ("flat", "grouped"):
             raise ValueError(
-                f"Must have a Qdrant collection with the name {self.qdrant_collection_name}."
+                f"Unknown broad_search_mode {broad_search_mode}, expected one of flat or grouped."
             )
+        self.broad_search_grouped = broad_search_mode == "grouped"
+        self.search_profiles = SearchProfiles.from_config(self.config)
 
         # Load embedding model
-        self.embedding_model = AutoModel.from_pretrained(
-            self.config["embedding_model_name"], trust_remote_code=True
+        self.embedding_model = self._load_embedding_model()
+        self.embedding_batcher = None
+        embedding_batch_max_size = int(
+            self.config.get("embedding_batch_max_size", 1)
+        )
+        if embedding_batch_max_size > 1:
+            self.embedding_batcher = EmbeddingBatcher(
+                self.encode_queries,
+                max_batch_size=embedding_batch_max_size,
+                max_wait_ms=float(
+                    self.config.get("embedding_batch_max_wait_ms", 5)
+                ),
+            )
+        self.embedding_cache = None
+        embedding_cache_max_bytes = int(
+            self.config.get("embedding_cache_max_bytes", 0)
         )
+        if embedding_cache_max_bytes > 0:
+            # Other backends are part of the cached model name, so that the
+            # vectors of a quantized model are not served for the original
+            embedding_model_name = self.config["embedding_model_name"]
+            embedding_backend = self.config.get("embedding_backend", "torch")
+            if embedding_backend != "torch":
+                embedding_model_name += f":{embedding_backend}"
+            self.embedding_cache = EmbeddingCache(
+                embedding_model_name,
+                max_bytes=embedding_cache_max_bytes,
+                ttl=float(self.config.get("embedding_cache_ttl", 0)),
+                path=self.config.get("embedding_cache_path"),
+            )
 
         self.pagerank_rerank_module = self.config["pagerank_rerank_module"]
         pagerank_file_path = self.config["pagerank_file_path"]
+        pagerank_table_path = self.config.get("pagerank_table_path")
         if self.pagerank_rerank_module:
-            if not pagerank_file_path:
+            has_table = pagerank_table_path and os.path.exists(
+                pagerank_table_path
+            )
+            if not pagerank_file_path and not has_table:
                 # Simulating reading from a CSV file
                 pagerank_file_path = os.path.join(
                     get_data_path(), "domain_ranks.csv"
@@ -77,167 +130,356 @@ class WebSearchEngine:
             self.pagerank_importance = float(
                 self.config["pagerank_importance"]
             )
-            self.domain_to_rank_map = {}
+            self.domain_ranks = load_domain_ranks(
+                pagerank_file_path, pagerank_table_path
+            )
+            public_suffix_file_path = self.config.get(
+                "public_suffix_file_path"
+            )
+            self.domain_resolver = DomainResolver(
+                read_public_suffixes(public_suffix_file_path)
+                if public_suffix_file_path
+                else None
+            )
+
+    def _load_config(self):
+        """The [agent_search] section of the config the engine is built from"""
+        return load_config()["agent_search"]
+
+    def _load_postgres_pool(self) -> PostgresConnectionPool:
+        """Creates the Postgres connection pool shared across searches"""
+        try:
+            import psycopg2  # noqa: F401
+        except ImportError as e:
+            raise ImportError(
+                f"Error {e} while imoprting psycopg2. Please install it with `pip install psycopg2` to run an WebSearchEngine instance."
+            )
+        return PostgresConnectionPool(self.config)
+
+    def _load_broad_payload_fields(self) -> Optional[Tuple[str, ...]]:
+        """The payload fields requested by the broad stage, None for full payloads"""
+        broad_search_payload = self.config.get("broad_search_payload", "full")
+        if broad_search_payload == "full":
+            return None
+        if broad_search_payload == "url":
+            return ("url",)
+        raise ValueError(
+            f"Unknown broad_search_payload {broad_search_payload}, expected one of full or url."
+        )
+
+    def _load_embedding_model(self):
+        """Loads the embedding model of the configured backend, importing it only when an engine is built"""
+        embedding_backend = self.config.get("embedding_backend", "torch")
+        if embedding_backend == "onnx":
+            return OnnxEmbeddingModel(
+                self.config["embedding_onnx_path"],
+                num_threads=int(self.config.get("embedding_onnx_threads", 0)),
+                quantized=self.config.getboolean(
+                    "embedding_onnx_quantized", True
+                ),
+            )
+        if embedding_backend != "torch":
+            raise ValueError(
+                f"Unknown embedding_backend {embedding_backend}, expected one of torch or onnx."
+            )
+
+        from transformers import AutoModel
+
+        return AutoModel.from_pretrained(
+            self.config["embedding_model_name"], trust_remote_code=True
+        )
 
-            with open(pagerank_file_path, newline="") as csvfile:
-                reader = csv.DictReader(csvfile)
-                for row in reader:
-                    domain = row["Domain"]
-                    rank = float(row["Open Page Rank"])
-                    self.domain_to_rank_map[domain] = rank
+    def _connect_vector_store(self):
+        """Connects the blocking methods of the vector store"""
+        self.vector_store.connect()
 
+    @METRICS.timed("embed")
     def get_query_vector(self, query: str):
         """Gets the query vector for the given query"""
 
-        query_vector = self.embedding_model.encode(query)
+        if self.embedding_cache is not None:
+            query_vector = self.embedding_cache.get(query)
+            if query_vector is not None:
+                return query_vector
+
+        if self.embedding_batcher is not None:
+            query_vector = self.embedding_batcher.encode_one(query)
+        else:
+            query_vector = self.embedding_model.encode(query)
+        if self.embedding_cache is not None:
+            self.embedding_cache.set(query, query_vector)
         return query_vector
 
+    def encode_queries(self, queries: List[str]) -> np.ndarray:
+        """Encodes a batch of queries with a single forward pass"""
+        return np.asarray(self.embedding_model.encode(queries))
+
+    def _cached_query_vectors(
+        self, queries: List[str]
+    ) -> Tuple[List[Optional[np.ndarray]], List[str]]:
+        """Looks the queries up in the embedding cache, returning the distinct queries missing from it"""
+        query_vectors = [
+            self.embedding_cache.get(query)
+            if self.embedding_cache is not None
+            else None
+            for query in queries
+        ]
+        missing_queries = list(
+            dict.fromkeys(
+                query
+                for query, query_vector in zip(queries, query_vectors)
+                if query_vector is None
+            )
+        )
+        return query_vectors, missing_queries
+
+    def _fill_query_vectors(
+        self,
+        queries: List[str],
+        query_vectors: List[Optional[np.ndarray]],
+        missing_queries: List[str],
+        encoded: np.ndarray,
+    ) -> np.ndarray:
+        """Fills the cache misses in with the encoded vectors, adding them to the cache"""
+        encoded_by_query = dict(zip(missing_queries, encoded))
+        if self.embedding_cache is not None:
+            for query, query_vector in encoded_by_query.items():
+                self.embedding_cache.set(query, query_vector)
+        return np.stack(
+            [
+                encoded_by_query[query]
+                if query_vector is None
+                else query_vector
+                for query, query_vector in zip(queries, query_vectors)
+            ]
+        )
+
+    @METRICS.timed("embed")
+    def get_query_vectors(self, queries: List[str]) -> np.ndarray:
+        """Gets the query vectors of a batch of queries, encoding every cache miss in one forward pass"""
+        query_vectors, missing_queries = self._cached_query_vectors(queries)
+        encoded = (
+            self.encode_queries(missing_queries) if missing_queries else []
+        )
+        return self._fill_query_vectors(
+            queries, query_vectors, missing_queries, encoded
+        )
+
+    @METRICS.timed("vector_search")
     def similarity_search(
         self,
         query_vector: np.ndarray,
         limit: int = 100,
-    ):
-        """Searches the collection for the given query and returns the top 'limit' results"""
+        search_filter: Optional[SearchFilter] = None,
+        payload_fields: Optional[Sequence[str]] = None,
+        precision: Optional[SearchPrecision] = None,
+    ) -> ResultBatch:
+        """Searches the collection for the given query and returns the top 'limit' results matching the filter
+
+        Pass `broad_payload_fields` as `payload_fields` when only the URLs of the results are used.
+        """
 
-        points = self.client.search(
-            collection_name=self.qdrant_collection_name,
-            query_vector=query_vector,
+        points = self.vector_store.search(
+            query_vector,
             limit=limit,
+            search_filter=search_filter,
+            payload_fields=payload_fields,
+            precision=precision,
         )
+        return ResultBatch.from_hits(points)
 
-        results = []
-        for point in points:
-            try:
-                results.append(
-                    AgentSearchResult(
-                        score=point.score,
-                        text=point.payload["text"],
-                        title=None,
-                        url=point.payload["url"],
-                        metadata={},
-                    )
-                )
-            except Exception as e:
-                logger.error(f"Error appending point {point} with {e}")
-        return results
+    @METRICS.timed("vector_search")
+    def grouped_similarity_search(
+        self,
+        query_vector: np.ndarray,
+        limit: int = 100,
+        search_filter: Optional[SearchFilter] = None,
+        payload_fields: Optional[Sequence[str]] = None,
+        precision: Optional[SearchPrecision] = None,
+    ) -> ResultBatch:
+        """Searches the collection for the best scoring point of each of the top 'limit' distinct URLs"""
+
+        points = self.vector_store.search_groups(
+            query_vector,
+            limit=limit,
+            search_filter=search_filter,
+            payload_fields=payload_fields,
+            precision=precision,
+            group_by="url",
+        )
+        return ResultBatch.from_hits(points)
+
+    def similarity_search_batch(
+        self, searches: Sequence[VectorSearch], grouped: bool = False
+    ) -> List[ResultBatch]:
+        """Runs several similarity searches, or grouped searches, together"""
+        if grouped:
+            return [
+                self.grouped_similarity_search(*search) for search in searches
+            ]
+        with METRICS.timer("vector_search"):
+            batch_points = self.vector_store.search_batch(searches)
+        return [ResultBatch.from_hits(points) for points in batch_points]
+
+    @METRICS.timed("postgres_fetch")
+    def execute_batch_query(self, urls: List[str]) -> List[tuple]:
+        """Fetches the rows for all given URLs with a pooled, prepared query"""
+        import psycopg2
 
-    # Example of batch processing
-    def execute_batch_query(self, urls, batch_size=20):
-        results = []
         try:
-            with psycopg2.connect(
-                dbname=self.config["postgres_db"],
-                user=self.config["postgres_user"],
-                password=self.config["postgres_password"],
-                host=self.config["postgres_host"],
-                options="-c client_encoding=UTF8",
-            ) as conn:
-                with conn.cursor() as cur:
-                    for i in range(0, len(urls), batch_size):
-                        batch_urls = urls[i : i + batch_size]
-                        logger.info(
-                            f"Executing batch query for URLs: {batch_urls[0:2]}"
-                        )
-                        query = f"SELECT url, title, metadata, dataset, text_chunks, embeddings FROM {self.config['postgres_table_name']} WHERE url = ANY(%s)"
-                        cur.execute(query, (batch_urls,))
-                        batch_results = cur.fetchall()
-                        results.extend(batch_results)
+            logger.info(f"Executing batch query for URLs: {urls[0:2]}")
+            return self.pool.fetch_urls(list(urls))
         except psycopg2.DatabaseError as e:
             logger.error(f"Database error: {e}")
         except Exception as e:
             logger.error(f"Error in execute_batch_query: {e}")
-        return results
+        record_degraded_fetch()
+        return []
+
+    def get_stats(self) -> dict:
+        """Returns the observable statistics of the engine's components"""
+        stats = {"postgres_pool": self.pool.get_stats()}
+        if self.embedding_cache is not None:
+            stats["embedding_cache"] = self.embedding_cache.get_stats()
+        if self.embedding_batcher is not None:
+            stats["embedding_batcher"] = self.embedding_batcher.get_stats()
+        if self.url_record_cache is not None:
+            stats["url_record_cache"] = self.url_record_cache.get_stats()
+        return stats
+
+    def close(self):
+        """Persists the embedding cache and closes the Postgres pool"""
+        if self.embedding_batcher is not None:
+            self.embedding_batcher.close()
+        if self.embedding_cache is not None:
+            self.embedding_cache.save()
+        self.pool.close()
+        self.vector_store.close()
 
     def hierarchical_similarity_reranking(
         self,
         query_vector: np.ndarray,
         urls: List[str],
         limit: int = 100,
-    ) -> List[AgentSearchResult]:
+    ) -> ResultBatch:
         """Hierarchical URL search to find the most similar text chunk for the given query and URLs"""
-        results = self.execute_batch_query(urls)
-        # List to store the results along with their similarity scores
-        similarity_results = []
-
-        # Iterate over each result to find the most similar text chunk
-        for result in results:
-            (
-                url,
-                title,
-                metadata,
-                dataset,
-                text_chunks_str,
-                embeddings_binary,
-            ) = result
-            # deserialize the embeddings and text chunks
-            embeddings = np.frombuffer(
-                embeddings_binary, dtype=np.float32
-            ).reshape(-1, 768)
-            text_chunks = json.loads(text_chunks_str)
-            max_similarity = -1e9
-            most_similar_chunk = None
-
-            # Iterate over each embedding to find the one with maximum cosine similarity
-            for chunk, embedding in zip(text_chunks, embeddings):
-                similarity = cosine_similarity(
-                    np.array(query_vector), np.array(embedding)
-                )
-                if similarity > max_similarity:
-                    max_similarity = similarity
-                    most_similar_chunk = chunk
-
-            # Store the most similar chunk and its similarity score
-            similarity_results.append(
-                AgentSearchResult(
-                    score=max_similarity,
-                    url=url,
-                    title=title,
-                    metadata=json.loads(metadata),
-                    dataset=dataset,
-                    text=most_similar_chunk,
-                ),
+        records = self.fetch_url_records(urls)
+        METRICS.count("url_records", len(records))
+        return self.rerank_url_records(query_vector, records, limit)
+
+    def hierarchical_similarity_reranking_batch(
+        self,
+        query_vectors: np.ndarray,
+        url_lists: List[List[str]],
+        limits: List[int],
+    ) -> List[ResultBatch]:
+        """Hierarchical search for several queries, fetching the union of their URLs once"""
+        records = self.fetch_url_records(
+            list(dict.fromkeys(url for urls in url_lists for url in urls))
+        )
+        return self._rerank_url_record_lists(
+            query_vectors, url_lists, limits, records
+        )
+
+    def _rerank_url_record_lists(
+        self,
+        query_vectors: np.ndarray,
+        url_lists: List[List[str]],
+        limits: List[int],
+        records: List[UrlRecord],
+    ) -> List[ResultBatch]:
+        """Reranks the shared records separately for each query and its URLs"""
+        records_by_url = {record.url: record for record in records}
+        return [
+            self.rerank_url_records(
+                query_vector,
+                [records_by_url[url] for url in urls if url in records_by_url],
+                limit,
+            )
+            for query_vector, urls, limit in zip(
+                query_vectors, url_lists, limits
+            )
+        ]
+
+    def _cached_url_records(
+        self, urls: List[str]
+    ) -> Tuple[List[UrlRecord], List[str]]:
+        """Splits the URLs into cached records and the URLs missing from the cache"""
+        if self.url_record_cache is None:
+            return [], list(urls)
+        records, missing_urls = [], []
+        for url in urls:
+            record = self.url_record_cache.get(url)
+            if record is None:
+                missing_urls.append(url)
+            else:
+                records.append(record)
+        return records, missing_urls
+
+    @METRICS.timed("decode")
+    def _decode_url_rows(self, rows: List[tuple]) -> List[UrlRecord]:
+        """Decodes the fetched rows and adds them to the cache"""
+        records = []
+        for row in rows:
+            record = decode_url_row(row)
+            if record is None:
+                continue
+            if self.url_record_cache is not None:
+                self.url_record_cache.set(record.url, record)
+            records.append(record)
+        return records
+
+    def fetch_url_records(self, urls: List[str]) -> List[UrlRecord]:
+        """Returns the decoded records of the URLs, only querying Postgres for cache misses"""
+        records, missing_urls = self._cached_url_records(urls)
+        if missing_urls:
+            records.extend(
+                self._decode_url_rows(self.execute_batch_query(missing_urls))
             )
+        return records
 
-        # Sort the results based on similarity score in descending order
-        similarity_results.sort(key=lambda x: x.score, reverse=True)
-        return similarity_results[:limit]
+    @METRICS.timed("rerank")
+    def rerank_url_records(
+        self,
+        query_vector: np.ndarray,
+        records: List[UrlRecord],
+        limit: int = 100,
+    ) -> ResultBatch:
+        """Scores the URL records and returns the top 'limit' best chunks"""
+        if not records:
+            return ResultBatch.empty()
+
+        # The chunk embeddings are pre-normalized, so a single matrix-vector
+        # product with the normalized query scores every chunk of every URL
+        matrix, offsets = stack_embeddings(
+            [record.embeddings for record in records]
+        )
+        scores = matrix @ normalize_vector(query_vector)
+        max_similarities, most_similar_chunks = segmented_argmax(
+            scores, offsets
+        )
+        return ResultBatch.from_records(
+            records, max_similarities, most_similar_chunks
+        ).top_k(limit)
 
+    @METRICS.timed("pagerank")
     def pagerank_reranking(
         self,
-        similarity_results: List[AgentSearchResult],
+        similarity_results: ResultBatch,
         limit: int = 100,
-    ) -> List[AgentSearchResult]:
+    ) -> ResultBatch:
         """Reranks the results based on the PageRank score of the domain"""
         if not self.pagerank_rerank_module:
             raise Exception(
                 "PageRank reranking module is not enabled. Please set pagerank_rerank_module=True while initializing the WebSearchEngine client."
             )
-        # List to store the results along with their PageRank scores
-        pagerank_results = []
-
-        # Iterate over each result to find the PageRank score of the domain
-        for result in similarity_results:
-            pagerank_score = 0
-            try:
-                domain = result.url.split("/")[2]
-                pagerank_score = self.domain_to_rank_map.get(domain, 0)
-            except Exception as e:
-                logger.info(f"Error {e}: Found for URL: {result.url}")
-            reweighted_score = (
-                self.pagerank_importance * pagerank_score / 10.0
-                + (1 - self.pagerank_importance) * result.score
-            )
-            pagerank_results.append(
-                AgentSearchResult(
-                    score=reweighted_score,
-                    url=result.url,
-                    title=result.title,
-                    metadata=result.metadata,
-                    dataset=result.dataset,
-                    text=result.text,
-                )
-            )
-
-        # Sort the results based on PageRank score in descending order
-        pagerank_results.sort(key=lambda x: x.score, reverse=True)
-        return pagerank_results[:limit]
+        # Look up the ranks of all result domains at once and reweight the
+        # similarity scores as arrays
+        pagerank_scores = self.domain_resolver.lookup_ranks(
+            self.domain_ranks, similarity_results.urls
+        )
+        reweighted_scores = (
+            self.pagerank_importance * pagerank_scores / 10.0
+            + (1 - self.pagerank_importance) * similarity_results.scores
+        )
+        return similarity_results.with_scores(reweighted_scores).top_k(limit)
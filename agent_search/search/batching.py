@@ -0,0 +1,124 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingBatcher:
+    """Collects concurrent encode requests into micro-batches run by a single worker thread.
+
+    A batch is dispatched once `max_batch_size` queries are waiting, or once the
+    oldest waiting query has waited `max_wait_ms`.
+    """
+
+    def __init__(
+        self,
+        encode: Callable[[List[str]], np.ndarray],
+        max_batch_size: int = 16,
+        max_wait_ms: float = 5.0,
+    ):
+        self.encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1_000.0
+        self.batches = 0
+        self.batch_size_counts: Dict[int, int] = {}
+        self.total_queue_time = 0.0
+        self._queue: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = threading.Thread(
+            target=self._run, name="embedding-batcher", daemon=True
+        )
+        self._worker.start()
+
+    def submit(self, query: str) -> Future:
+        """Queues a query, the returned future resolves to its embedding"""
+        future: Future = Future()
+        self._queue.put((query, future, time.monotonic()))
+        return future
+
+    def encode_one(self, query: str) -> np.ndarray:
+        return self.submit(query).result()
+
+    def _collect(self) -> list:
+        """Blocks for a first request, then gathers more until the batch is full or the wait is over"""
+        requests = [self._queue.get()]
+        if requests[0] is None:
+            return requests
+        deadline = requests[0][2] + self.max_wait
+        while len(requests) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                request = (
+                    self._queue.get(timeout=timeout)
+                    if timeout > 0
+                    else self._queue.get_nowait()
+                )
+            except queue.Empty:
+                break
+            requests.append(request)
+            if request is None:
+                break
+        return requests
+
+    def _run(self):
+        while True:
+            requests = self._collect()
+            stop = requests[-1] is None
+            requests = [request for request in requests if request is not None]
+            if requests:
+                self._encode_batch(requests)
+            if stop:
+                return
+
+    def _encode_batch(self, requests: Sequence[tuple]):
+        dispatched_at = time.monotonic()
+        with self._lock:
+            self.batches += 1
+            self.batch_size_counts[len(requests)] = (
+                self.batch_size_counts.get(len(requests), 0) + 1
+            )
+            self.total_queue_time += sum(
+                dispatched_at - queued_at for _, _, queued_at in requests
+            )
+        try:
+            query_vectors = self.encode([query for query, _, _ in requests])
+        except Exception as e:
+            logger.error(f"Error {e} while encoding a batch")
+            for _, future, _ in requests:
+                future.set_exception(e)
+            return
+        for (_, future, _), query_vector in zip(requests, query_vectors):
+            future.set_result(query_vector)
+
+    def get_stats(self) -> Dict[str, object]:
+        """Returns the batch-size histogram along with queueing statistics"""
+        with self._lock:
+            queries = sum(
+                size * count for size, count in self.batch_size_counts.items()
+            )
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1_000.0,
+                "batches": self.batches,
+                "queries": queries,
+                "mean_batch_size": queries / self.batches
+                if self.batches
+                else 0.0,
+                "mean_queue_time": self.total_queue_time / queries
+                if queries
+                else 0.0,
+                "batch_size_histogram": dict(
+                    sorted(self.batch_size_counts.items())
+                ),
+            }
+
+    def close(self):
+        """Stops the worker once every queued query has been encoded"""
+        self._queue.put(None)
+        self._worker.join()
@@ -0,0 +1,290 @@
+import csv
+import hashlib
+import logging
+import os
+import struct
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TABLE_MAGIC = b"ASRANKS1"
+HEADER_SIZE = len(TABLE_MAGIC) + 8
+
+
+def hash_domain(domain: str) -> int:
+    """A 64-bit hash of the lowercased domain, stable across processes"""
+    return int.from_bytes(
+        hashlib.blake2b(
+            domain.lower().encode("utf-8"), digest_size=8
+        ).digest(),
+        "little",
+    )
+
+
+def hash_domains(domains: Iterable[str]) -> np.ndarray:
+    return np.fromiter((hash_domain(d) for d in domains), dtype=np.uint64)
+
+
+def read_domain_ranks_csv(csv_path: str) -> Dict[str, float]:
+    """Reads the 'Domain' and 'Open Page Rank' columns of the rank CSV"""
+    domain_to_rank_map = {}
+    with open(csv_path, newline="") as csvfile:
+        reader = csv.DictReader(csvfile)
+        for row in reader:
+            domain = row["Domain"]
+            rank = float(row["Open Page Rank"])
+            domain_to_rank_map[domain] = rank
+    return domain_to_rank_map
+
+
+def compile_domain_ranks(csv_path: str, table_path: str) -> int:
+    """Compiles the rank CSV into a table of sorted domain hashes and float32 ranks.
+
+    Returns the number of domains written.
+    """
+    domain_to_rank_map = read_domain_ranks_csv(csv_path)
+    hashes = hash_domains(domain_to_rank_map.keys())
+    ranks = np.fromiter(domain_to_rank_map.values(), dtype=np.float32)
+    # Keep the last rank seen for a domain, as the dict-based lookup did
+    hashes, unique_index = np.unique(hashes[::-1], return_index=True)
+    ranks = ranks[::-1][unique_index]
+
+    tmp_path = f"{table_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(TABLE_MAGIC)
+        f.write(struct.pack("<Q", len(hashes)))
+        f.write(hashes.astype("<u8").tobytes())
+        f.write(ranks.astype("<f4").tobytes())
+    os.replace(tmp_path, table_path)
+    return len(hashes)
+
+
+class DomainRanks(ABC):
+    """Looks up the PageRank of domains"""
+
+    def get(self, domain: str, default: float = 0.0) -> float:
+        return float(self.lookup([domain], default)[0])
+
+    @abstractmethod
+    def lookup(
+        self, domains: Sequence[str], default: float = 0.0
+    ) -> np.ndarray:
+        pass
+
+
+class DomainRankTable(DomainRanks):
+    """A compiled rank table, memory-mapped so that worker processes share its pages"""
+
+    def __init__(self, table_path: str):
+        with open(table_path, "rb") as f:
+            header = f.read(HEADER_SIZE)
+        if header[: len(TABLE_MAGIC)] != TABLE_MAGIC:
+            raise ValueError(
+                f"{table_path} is not a compiled domain rank table."
+            )
+        (count,) = struct.unpack("<Q", header[len(TABLE_MAGIC) :])
+        self.hashes, self.ranks = (
+            np.empty(0, dtype=np.uint64),
+            np.empty(0, dtype=np.float32),
+        )
+        if count == 0:
+            return
+        self.hashes = np.memmap(
+            table_path,
+            dtype="<u8",
+            mode="r",
+            offset=HEADER_SIZE,
+            shape=(count,),
+        )
+        self.ranks = np.memmap(
+            table_path,
+            dtype="<f4",
+            mode="r",
+            offset=HEADER_SIZE + 8 * count,
+            shape=(count,),
+        )
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def lookup(
+        self, domains: Sequence[str], default: float = 0.0
+    ) -> np.ndarray:
+        hashes = hash_domains(domains)
+        if len(self.hashes) == 0:
+            return np.full(len(hashes), default, dtype=np.float32)
+        positions = np.searchsorted(self.hashes, hashes)
+        positions[positions == len(self.hashes)] = 0
+        found = self.hashes[positions] == hashes
+        return np.where(found, self.ranks[positions], default).astype(
+            np.float32
+        )
+
+
+class CsvDomainRanks(DomainRanks):
+    """Ranks parsed from the CSV into a dict, for when no compiled table exists"""
+
+    def __init__(self, csv_path: str):
+        self.domain_to_rank_map = {
+            domain.lower(): rank
+            for domain, rank in read_domain_ranks_csv(csv_path).items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.domain_to_rank_map)
+
+    def lookup(
+        self, domains: Sequence[str], default: float = 0.0
+    ) -> np.ndarray:
+        return np.fromiter(
+            (
+                self.domain_to_rank_map.get(domain.lower(), default)
+                for domain in domains
+            ),
+            dtype=np.float32,
+            count=len(domains),
+        )
+
+
+def load_domain_ranks(
+    csv_path: str, table_path: Optional[str] = None
+) -> DomainRanks:
+    """Opens the compiled table when there is one, falling back to the CSV"""
+    if table_path and os.path.exists(table_path):
+        table = DomainRankTable(table_path)
+        logger.info(
+            f"Memory-mapped {len(table)} domain ranks from {table_path}"
+        )
+        return table
+    if table_path:
+        logger.warning(
+            f"No compiled domain rank table at {table_path}, reading {csv_path} instead."
+        )
+    return CsvDomainRanks(csv_path)
+
+
+# Multi-label public suffixes under which domains are registered, a compact
+# subset of the public suffix list used when no list file is configured
+DEFAULT_PUBLIC_SUFFIXES = frozenset(
+    """
+    co.uk org.uk ac.uk gov.uk me.uk ltd.uk plc.uk net.uk sch.uk nhs.uk
+    com.au net.au org.au edu.au gov.au asn.au id.au
+    co.nz org.nz net.nz ac.nz govt.nz
+    co.jp ne.jp or.jp ac.jp go.jp
+    co.kr or.kr ac.kr go.kr
+    com.br net.br org.br gov.br edu.br
+    com.cn net.cn org.cn gov.cn edu.cn ac.cn
+    com.hk org.hk edu.hk gov.hk
+    com.tw org.tw edu.tw gov.tw
+    com.sg edu.sg gov.sg
+    co.in net.in org.in ac.in edu.in gov.in
+    co.za org.za ac.za gov.za
+    com.mx org.mx edu.mx gob.mx
+    com.ar gob.ar
+    com.tr org.tr edu.tr gov.tr
+    co.il org.il ac.il gov.il
+    com.my edu.my gov.my
+    com.ph edu.ph gov.ph
+    co.id ac.id go.id or.id
+    com.pk edu.pk gov.pk
+    com.eg edu.eg gov.eg
+    com.sa edu.sa gov.sa
+    com.ua org.ua edu.ua gov.ua
+    co.th ac.th go.th or.th
+    com.vn edu.vn gov.vn
+    com.ng edu.ng gov.ng
+    co.ke ac.ke go.ke
+    github.io blogspot.com
+    """.split()
+)
+
+
+def read_public_suffixes(path: str) -> frozenset:
+    """Reads the rules of a public suffix list file, e.g. public_suffix_list.dat"""
+    suffixes = set()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            rule = line.strip()
+            if not rule or rule.startswith("//") or rule.startswith("!"):
+                continue
+            suffixes.add(rule.lower())
+    return frozenset(suffixes)
+
+
+class DomainResolver:
+    """Resolves URLs to the hosts to look up ranks for, from most specific to the registered domain"""
+
+    def __init__(self, public_suffixes: Optional[frozenset] = None):
+        self.public_suffixes = public_suffixes or DEFAULT_PUBLIC_SUFFIXES
+        self.candidates = lru_cache(maxsize=65_536)(self._candidates)
+
+    def _is_public_suffix(self, labels: Sequence[str]) -> bool:
+        # Any single label is a top-level public suffix
+        suffix = ".".join(labels)
+        if len(labels) == 1 or suffix in self.public_suffixes:
+            return True
+        return (
+            len(labels) > 1
+            and "*." + ".".join(labels[1:]) in self.public_suffixes
+        )
+
+    def registered_domain(self, host: str) -> str:
+        """The public suffix plus one label, e.g. example.co.uk for www.example.co.uk"""
+        labels = host.split(".")
+        for i in range(len(labels) - 1):
+            if self._is_public_suffix(labels[i + 1 :]):
+                return ".".join(labels[i:])
+        return host
+
+    def _candidates(self, host: str) -> Tuple[str, ...]:
+        host = host.lower().rstrip(".")
+        if not host or host.replace(".", "").isdigit() or ":" in host:
+            return (host,)
+        registered_domain = self.registered_domain(host)
+        labels = host.split(".")
+        candidates = []
+        for i in range(len(labels)):
+            candidate = ".".join(labels[i:])
+            candidates.append(candidate)
+            if candidate == registered_domain:
+                break
+        return tuple(candidates)
+
+    def url_candidates(self, url: str) -> Tuple[str, ...]:
+        try:
+            host = urlsplit(url).hostname or ""
+        except ValueError:
+            host = ""
+        return self.candidates(host)
+
+    def lookup_ranks(
+        self, domain_ranks: DomainRanks, urls: Sequence[str]
+    ) -> np.ndarray:
+        """Ranks each URL by its most specific host found in the rank table, 0 if none is"""
+        candidate_lists = [self.url_candidates(url) for url in urls]
+        lengths = np.fromiter(
+            (len(c) for c in candidate_lists), dtype=np.int64, count=len(urls)
+        )
+        if len(urls) == 0:
+            return np.zeros(0, dtype=np.float32)
+        offsets = np.zeros(len(urls), dtype=np.int64)
+        np.cumsum(lengths[:-1], out=offsets[1:])
+
+        ranks = domain_ranks.lookup(
+            [c for candidates in candidate_lists for c in candidates],
+            default=np.nan,
+        )
+        # The first candidate found within each URL's segment wins
+        positions = np.where(
+            np.isnan(ranks), len(ranks), np.arange(len(ranks))
+        )
+        first_found = np.minimum.reduceat(positions, offsets)
+        found = first_found < offsets + lengths
+        return np.where(
+            found, ranks[np.minimum(first_found, len(ranks) - 1)], 0.0
+        ).astype(np.float32)
@@ -0,0 +1,158 @@
+import logging
+import os
+from typing import Dict, List, Sequence, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ONNX_FP32_FILE = "model.onnx"
+ONNX_INT8_FILE = "model.int8.onnx"
+
+
+def _import_onnxruntime():
+    try:
+        import onnxruntime
+    except ImportError as e:
+        raise ImportError(
+            f"Error {e} while importing onnxruntime. Please install it with `pip install onnxruntime` to use the onnx embedding backend."
+        )
+    return onnxruntime
+
+
+def export_onnx_model(
+    model_name: str,
+    output_dir: str,
+    quantize: bool = True,
+    opset_version: int = 14,
+) -> str:
+    """Exports the transformer of an embedding model to ONNX, along with its tokenizer.
+
+    With `quantize` the weights are then dynamically quantized to INT8.
+    Returns the path of the model to load.
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    tokenizer.save_pretrained(output_dir)
+    model = AutoModel.from_pretrained(model_name, trust_remote_code=True)
+    model.eval()
+
+    inputs = tokenizer(["an example query"], return_tensors="pt")
+    fp32_path = os.path.join(output_dir, ONNX_FP32_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (inputs["input_ids"], inputs["attention_mask"]),
+            fp32_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "last_hidden_state": {0: "batch", 1: "sequence"},
+            },
+            opset_version=opset_version,
+        )
+    if not quantize:
+        return fp32_path
+
+    _import_onnxruntime()
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    int8_path = os.path.join(output_dir, ONNX_INT8_FILE)
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    return int8_path
+
+
+class OnnxEmbeddingModel:
+    """Encodes queries with an exported ONNX model on the CPU runtime.
+
+    `encode` mirrors the model's own: the attention-masked mean of the last
+    hidden state, a vector for a single query and a matrix for a list.
+    """
+
+    def __init__(
+        self,
+        model_dir: str,
+        num_threads: int = 0,
+        max_length: int = 512,
+        quantized: bool = True,
+    ):
+        onnxruntime = _import_onnxruntime()
+        from transformers import AutoTokenizer
+
+        model_path = os.path.join(
+            model_dir, ONNX_INT8_FILE if quantized else ONNX_FP32_FILE
+        )
+        if not os.path.exists(model_path):
+            raise ValueError(
+                f"No ONNX model at {model_path}, export one with scripts/export_onnx_embeddings.py."
+            )
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = (
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(
+            model_path, options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.max_length = max_length
+        logger.info(f"Loaded ONNX embedding model from {model_path}")
+
+    def encode(
+        self, sentences: Union[str, Sequence[str]], batch_size: int = 32
+    ) -> np.ndarray:
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        embeddings = [
+            self._encode_batch(list(sentences[start : start + batch_size]))
+            for start in range(0, len(sentences), batch_size)
+        ]
+        embeddings = (
+            np.concatenate(embeddings)
+            if embeddings
+            else np.empty((0, 0), dtype=np.float32)
+        )
+        return embeddings[0] if single else embeddings
+
+    def _encode_batch(self, sentences: List[str]) -> np.ndarray:
+        inputs = self.tokenizer(
+            sentences,
+            padding=True,
+            truncation=True,
+            max_length=self.max_length,
+            return_tensors="np",
+        )
+        feed = {
+            name: inputs[name].astype(np.int64)
+            for name in self.input_names
+            if name in inputs
+        }
+        (last_hidden_state,) = self.session.run(["last_hidden_state"], feed)
+        mask = inputs["attention_mask"][..., None].astype(np.float32)
+        return (last_hidden_state * mask).sum(axis=1) / np.maximum(
+            mask.sum(axis=1), 1e-9
+        )
+
+
+def check_equivalence(
+    reference_model, candidate_model, sentences: Sequence[str]
+) -> Dict[str, float]:
+    """Compares the candidate's embeddings to the reference's by cosine similarity"""
+    reference = np.asarray(reference_model.encode(list(sentences)))
+    candidate = np.asarray(candidate_model.encode(list(sentences)))
+    cosines = np.sum(reference * candidate, axis=1) / (
+        np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1)
+    )
+    return {
+        "sentences": len(sentences),
+        "mean_cosine": float(cosines.mean()),
+        "min_cosine": float(cosines.min()),
+    }
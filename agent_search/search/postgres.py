@@ -0,0 +1,227 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+FETCH_URLS_STATEMENT = "agent_search_fetch_urls"
+
+
+class FetchStatus:
+    """Whether a tracked Postgres fetch failed, leaving the results built from it partial"""
+
+    def __init__(self):
+        self.degraded = False
+
+
+_fetch_status: ContextVar[Optional[FetchStatus]] = ContextVar(
+    "fetch_status", default=None
+)
+
+
+@contextmanager
+def track_fetches() -> Iterator[FetchStatus]:
+    """Tracks the fetches made within, including those of tasks and threads started within"""
+    status = FetchStatus()
+    token = _fetch_status.set(status)
+    try:
+        yield status
+    finally:
+        _fetch_status.reset(token)
+
+
+def record_degraded_fetch():
+    """Marks the tracked fetches as degraded, after a fetch returned no rows because it failed"""
+    status = _fetch_status.get()
+    if status is not None:
+        status.degraded = True
+
+
+def fetch_urls_query(table_name: str) -> str:
+    """The query used to fetch the stored rows for a list of URLs"""
+    return f"SELECT url, title, metadata, dataset, text_chunks, embeddings FROM {table_name} WHERE url = ANY($1::text[])"
+
+
+class PoolStats:
+    """Running counters describing how a connection pool is being used"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.checkouts = 0
+        self.timeouts = 0
+        self.reconnects = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+        self._lock = threading.Lock()
+
+    def record_checkout(self, wait_time: float):
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def record_reconnect(self):
+        with self._lock:
+            self.reconnects += 1
+
+    def to_dict(self, size: int, idle: int) -> Dict[str, float]:
+        return {
+            "size": size,
+            "idle": idle,
+            "in_use": size - idle,
+            "max_size": self.max_size,
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "reconnects": self.reconnects,
+            "total_wait_time": self.total_wait_time,
+            "mean_wait_time": self.total_wait_time / self.checkouts
+            if self.checkouts
+            else 0.0,
+            "max_wait_time": self.max_wait_time,
+        }
+
+
+class PostgresConnectionPool:
+    """A thread-safe, health-checked pool of psycopg2 connections.
+
+    psycopg2 is imported by the methods which use it, so that the async
+    engine can use this module without it.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.min_size = int(config.get("postgres_pool_min_size", 1))
+        self.max_size = int(config.get("postgres_pool_max_size", 8))
+        self.timeout = float(config.get("postgres_pool_timeout", 10))
+        self.health_check_interval = float(
+            config.get("postgres_pool_health_check_interval", 30)
+        )
+        self.stats = PoolStats(self.max_size)
+
+        self._idle: deque = deque()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_size)
+
+        for _ in range(self.min_size):
+            self._idle.append((self._connect(), time.monotonic()))
+            self._size += 1
+
+    def _connect(self):
+        """Opens a new connection and prepares the URL lookup on it"""
+        import psycopg2
+
+        conn = psycopg2.connect(
+            dbname=self.config["postgres_db"],
+            user=self.config["postgres_user"],
+            password=self.config["postgres_password"],
+            host=self.config["postgres_host"],
+            options="-c client_encoding=UTF8",
+        )
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(
+                f"PREPARE {FETCH_URLS_STATEMENT} (text[]) AS {fetch_urls_query(self.config['postgres_table_name'])}"
+            )
+        return conn
+
+    def _is_healthy(self, conn, last_used: float) -> bool:
+        """Checks a connection which has been idle for too long"""
+        import psycopg2
+
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        import psycopg2
+
+        with self._lock:
+            self._size -= 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    self._size += 1
+                    break
+                conn, last_used = self._idle.pop()
+            if self._is_healthy(conn, last_used):
+                return conn
+            self.stats.record_reconnect()
+            self._discard(conn)
+        try:
+            return self._connect()
+        except Exception:
+            with self._lock:
+                self._size -= 1
+            raise
+
+    @contextmanager
+    def connection(self):
+        """Checks out a connection, waiting up to the pool timeout for one"""
+        import psycopg2
+
+        start = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            self.stats.record_timeout()
+            raise TimeoutError(
+                f"Timed out after {self.timeout}s waiting for a Postgres connection."
+            )
+        try:
+            conn = self._checkout()
+            self.stats.record_checkout(time.monotonic() - start)
+            healthy = True
+            try:
+                yield conn
+            except psycopg2.Error:
+                healthy = False
+                raise
+            finally:
+                if healthy:
+                    with self._lock:
+                        self._idle.append((conn, time.monotonic()))
+                else:
+                    self._discard(conn)
+        finally:
+            self._slots.release()
+
+    def fetch_urls(self, urls: List[str]) -> List[tuple]:
+        """Fetches the rows for all given URLs in a single round trip"""
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"EXECUTE {FETCH_URLS_STATEMENT} (%s)", (urls,))
+                return cur.fetchall()
+
+    def get_stats(self) -> Dict[str, float]:
+        """Returns the pool size along with checkout wait statistics"""
+        with self._lock:
+            size, idle = self._size, len(self._idle)
+        return self.stats.to_dict(size, idle)
+
+    def close(self):
+        """Closes every idle connection in the pool"""
+        with self._lock:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._size -= 1
+                conn.close()
@@ -0,0 +1,92 @@
+from typing import Dict, NamedTuple, Optional
+
+SEARCH_PROFILES = ("fast", "balanced", "exact")
+
+
+class SearchPrecision(NamedTuple):
+    """ANN parameters trading recall for latency on a single search.
+
+    None leaves a parameter at the collection's default. `rescore` and
+    `oversampling` apply to quantized vectors, and `exact` skips the index.
+    """
+
+    hnsw_ef: Optional[int] = None
+    exact: bool = False
+    rescore: Optional[bool] = None
+    oversampling: Optional[float] = None
+
+
+class SearchProfiles:
+    """The named precision profiles a search can request, read from the config"""
+
+    def __init__(
+        self,
+        profiles: Dict[str, SearchPrecision],
+        default_profile: str = "balanced",
+        max_hnsw_ef: int = 512,
+        max_oversampling: float = 4.0,
+        allow_exact: bool = True,
+    ):
+        if default_profile not in profiles:
+            raise ValueError(
+                f"Unknown default search profile {default_profile}, expected one of {', '.join(profiles)}."
+            )
+        self.profiles = profiles
+        self.default_profile = default_profile
+        self.max_hnsw_ef = max_hnsw_ef
+        self.max_oversampling = max_oversampling
+        self.allow_exact = allow_exact
+
+    @classmethod
+    def from_config(cls, config) -> "SearchProfiles":
+        """Reads `search_profile_<name>_<parameter>` keys for each profile"""
+
+        def get(profile, parameter, parse):
+            value = config.get(f"search_profile_{profile}_{parameter}")
+            return parse(value) if value else None
+
+        def parse_bool(value):
+            return value.strip().lower() in ("1", "true", "yes", "on")
+
+        profiles = {
+            profile: SearchPrecision(
+                hnsw_ef=get(profile, "hnsw_ef", int),
+                exact=bool(get(profile, "exact", parse_bool)),
+                rescore=get(profile, "rescore", parse_bool),
+                oversampling=get(profile, "oversampling", float),
+            )
+            for profile in SEARCH_PROFILES
+        }
+        return cls(
+            profiles,
+            default_profile=config.get("search_profile_default", "balanced"),
+            max_hnsw_ef=int(config.get("search_max_hnsw_ef", 512)),
+            max_oversampling=float(config.get("search_max_oversampling", 4.0)),
+            allow_exact=config.getboolean("search_allow_exact", True),
+        )
+
+    def resolve(
+        self, profile: Optional[str] = None, hnsw_ef: Optional[int] = None
+    ) -> SearchPrecision:
+        """The precision of the profile, with `hnsw_ef` overridden when given, within the caps"""
+        profile = profile or self.default_profile
+        if profile not in self.profiles:
+            raise ValueError(
+                f"Unknown search profile {profile}, expected one of {', '.join(self.profiles)}."
+            )
+        precision = self.profiles[profile]
+        if precision.exact and not self.allow_exact:
+            raise ValueError("Exact searches are disabled on this server.")
+        if hnsw_ef is not None:
+            if hnsw_ef <= 0:
+                raise ValueError("hnsw_ef must be positive.")
+            precision = precision._replace(hnsw_ef=hnsw_ef)
+        if precision.hnsw_ef is not None:
+            precision = precision._replace(
+                hnsw_ef=min(precision.hnsw_ef, self.max_hnsw_ef)
+            )
+        if precision.oversampling is not None:
+            precision = precision._replace(
+                oversampling=min(precision.oversampling, self.max_oversampling)
+            )
+        return precision
@@ -0,0 +1,55 @@
+import json
+import sys
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+
+from agent_search.core.utils import decode_embeddings
+
+
+class UrlRecord(NamedTuple):
+    """The decoded Postgres row of a URL, with L2-normalized chunk embeddings
+
+    Embeddings stored as normalized float16 are kept in that precision.
+    """
+
+    url: str
+    title: Optional[str]
+    metadata: str
+    dataset: Optional[str]
+    text_chunks: List[str]
+    embeddings: np.ndarray
+
+    def nbytes(self) -> int:
+        """Approximate resident size of the record"""
+        return (
+            self.embeddings.nbytes
+            + sum(sys.getsizeof(chunk) for chunk in self.text_chunks)
+            + sys.getsizeof(self.metadata)
+            + sys.getsizeof(self.url)
+        )
+
+
+def decode_url_row(row: tuple) -> Optional[UrlRecord]:
+    """Deserializes a fetched row, returning None when it has no chunks"""
+    url, title, metadata, dataset, text_chunks_str, embeddings_binary = row
+    embeddings, normalized = decode_embeddings(embeddings_binary)
+    text_chunks = json.loads(text_chunks_str)
+    num_chunks = min(len(text_chunks), len(embeddings))
+    if num_chunks == 0:
+        return None
+
+    embeddings = embeddings[:num_chunks]
+    if not normalized:
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        embeddings = embeddings / norms
+    embeddings.setflags(write=False)
+    return UrlRecord(
+        url=url,
+        title=title,
+        metadata=metadata,
+        dataset=dataset,
+        text_chunks=text_chunks[:num_chunks],
+        embeddings=embeddings,
+    )
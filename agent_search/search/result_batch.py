@@ -0,0 +1,137 @@
+import json
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from agent_search.core import AgentSearchResult
+from agent_search.core.utils import top_k_indices
+
+from .records import UrlRecord
+
+
+class ResultBatch:
+    """Columnar results passed between the stages of a search.
+
+    Scores and chunk indices are arrays, and the text, title and metadata of a
+    result are only read from its payload or record when `to_results` builds
+    the final AgentSearchResult objects.
+    """
+
+    def __init__(
+        self,
+        scores: np.ndarray,
+        urls: List[str],
+        payloads: Optional[List[Dict[str, Any]]] = None,
+        records: Optional[List[UrlRecord]] = None,
+        chunk_indices: Optional[np.ndarray] = None,
+    ):
+        self.scores = np.asarray(scores, dtype=np.float64)
+        self.urls = urls
+        self.payloads = payloads
+        self.records = records
+        self.chunk_indices = chunk_indices
+
+    def __len__(self) -> int:
+        return len(self.urls)
+
+    @classmethod
+    def empty(cls) -> "ResultBatch":
+        return cls(np.empty(0), [])
+
+    @classmethod
+    def from_hits(cls, hits: Sequence[Any]) -> "ResultBatch":
+        """Builds a batch from scored vector store points, skipping points without a URL"""
+        hits = [hit for hit in hits if hit.payload and "url" in hit.payload]
+        return cls(
+            np.fromiter(
+                (hit.score for hit in hits), dtype=np.float64, count=len(hits)
+            ),
+            [hit.payload["url"] for hit in hits],
+            payloads=[hit.payload for hit in hits],
+        )
+
+    @classmethod
+    def from_records(
+        cls,
+        records: List[UrlRecord],
+        scores: np.ndarray,
+        chunk_indices: np.ndarray,
+    ) -> "ResultBatch":
+        return cls(
+            scores,
+            [record.url for record in records],
+            records=records,
+            chunk_indices=chunk_indices,
+        )
+
+    def take(self, indices: np.ndarray) -> "ResultBatch":
+        """Selects and reorders the results without touching their contents"""
+        return ResultBatch(
+            self.scores[indices],
+            [self.urls[i] for i in indices],
+            payloads=None
+            if self.payloads is None
+            else [self.payloads[i] for i in indices],
+            records=None
+            if self.records is None
+            else [self.records[i] for i in indices],
+            chunk_indices=None
+            if self.chunk_indices is None
+            else self.chunk_indices[indices],
+        )
+
+    def top_k(self, k: int) -> "ResultBatch":
+        """The 'k' best scoring results in descending order"""
+        return self.take(top_k_indices(self.scores, k))
+
+    def unique_urls(self, limit: int) -> "ResultBatch":
+        """The first result of each of the first 'limit' distinct URLs"""
+        seen_urls = set()
+        indices = []
+        for i, url in enumerate(self.urls):
+            if url in seen_urls:
+                continue
+            seen_urls.add(url)
+            indices.append(i)
+            if len(indices) >= limit:
+                break
+        return self.take(np.asarray(indices, dtype=np.int64))
+
+    def with_scores(self, scores: np.ndarray) -> "ResultBatch":
+        return ResultBatch(
+            scores,
+            self.urls,
+            payloads=self.payloads,
+            records=self.records,
+            chunk_indices=self.chunk_indices,
+        )
+
+    def to_results(self) -> List[AgentSearchResult]:
+        """Builds the AgentSearchResult objects returned at the API boundary"""
+        results = []
+        for i, url in enumerate(self.urls):
+            if self.records is not None:
+                record = self.records[i]
+                results.append(
+                    AgentSearchResult(
+                        score=float(self.scores[i]),
+                        url=url,
+                        title=record.title,
+                        metadata=json.loads(record.metadata),
+                        dataset=record.dataset,
+                        text=record.text_chunks[self.chunk_indices[i]],
+                    )
+                )
+            else:
+                payload = self.payloads[i] if self.payloads else {}
+                results.append(
+                    AgentSearchResult(
+                        score=float(self.scores[i]),
+                        url=url,
+                        title=None,
+                        dataset=None,
+                        metadata={},
+                        text=payload.get("text", ""),
+                    )
+                )
+        return results
@@ -0,0 +1,117 @@
+import os
+import struct
+import uuid
+from typing import Iterable, List, Optional, Sequence
+
+import numpy as np
+
+MAP_MAGIC = b"ASURLID1"
+HEADER_SIZE = len(MAP_MAGIC) + 8 + 8
+
+
+def point_id(url: str) -> str:
+    """The id of the vector store point written for a URL"""
+    return str(uuid.uuid3(uuid.NAMESPACE_DNS, url))
+
+
+def _split_ids(ids: Iterable[str]) -> np.ndarray:
+    """Splits uuid strings into (high, low) 64-bit halves"""
+    halves = [divmod(uuid.UUID(str(i)).int, 1 << 64) for i in ids]
+    return np.array(halves, dtype=np.uint64).reshape(-1, 2)
+
+
+def compile_url_id_map(urls: Iterable[str], map_path: str) -> int:
+    """Writes a table of sorted point ids and their URLs to `map_path`.
+
+    The file holds the high and low halves of each id, the offsets of each
+    URL and the UTF-8 URLs themselves. Returns the number of URLs written.
+    """
+    urls = list(dict.fromkeys(urls))
+    halves = _split_ids(point_id(url) for url in urls)
+    order = np.lexsort((halves[:, 1], halves[:, 0]))
+    encoded = [urls[i].encode("utf-8") for i in order]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+    np.cumsum([len(url) for url in encoded], out=offsets[1:])
+
+    tmp_path = f"{map_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAP_MAGIC)
+        f.write(struct.pack("<QQ", len(encoded), int(offsets[-1])))
+        f.write(halves[order, 0].astype("<u8").tobytes())
+        f.write(halves[order, 1].astype("<u8").tobytes())
+        f.write(offsets.astype("<u8").tobytes())
+        for url in encoded:
+            f.write(url)
+    os.replace(tmp_path, map_path)
+    return len(encoded)
+
+
+class UrlIdMap:
+    """A compiled id to URL map, memory-mapped so that searches can skip payloads"""
+
+    def __init__(self, map_path: str):
+        with open(map_path, "rb") as f:
+            header = f.read(HEADER_SIZE)
+        if header[: len(MAP_MAGIC)] != MAP_MAGIC:
+            raise ValueError(f"{map_path} is not a compiled URL id map.")
+        count, blob_size = struct.unpack("<QQ", header[len(MAP_MAGIC) :])
+        self.high, self.low, self.offsets, self.blob = (
+            np.empty(0, dtype=np.uint64),
+            np.empty(0, dtype=np.uint64),
+            np.zeros(1, dtype=np.uint64),
+            np.empty(0, dtype=np.uint8),
+        )
+        if count == 0:
+            return
+        offset = HEADER_SIZE
+        self.high = np.memmap(
+            map_path, dtype="<u8", mode="r", offset=offset, shape=(count,)
+        )
+        offset += 8 * count
+        self.low = np.memmap(
+            map_path, dtype="<u8", mode="r", offset=offset, shape=(count,)
+        )
+        offset += 8 * count
+        self.offsets = np.memmap(
+            map_path,
+            dtype="<u8",
+            mode="r",
+            offset=offset,
+            shape=(count + 1,),
+        )
+        offset += 8 * (count + 1)
+        self.blob = np.memmap(
+            map_path,
+            dtype=np.uint8,
+            mode="r",
+            offset=offset,
+            shape=(blob_size,),
+        )
+
+    def __len__(self) -> int:
+        return len(self.high)
+
+    def lookup(self, ids: Sequence[str]) -> List[Optional[str]]:
+        """The URL of each point id, None for ids missing from the map"""
+        if len(ids) == 0:
+            return []
+        halves = _split_ids(ids)
+        if len(self.high) == 0:
+            return [None] * len(ids)
+        positions = np.searchsorted(self.high, halves[:, 0])
+        positions[positions == len(self.high)] = 0
+        # Ids sharing a high half are adjacent, so step over them to the
+        # matching low half
+        urls: List[Optional[str]] = []
+        for (high, low), position in zip(halves, positions):
+            while position < len(self.high) and self.high[position] == high:
+                if self.low[position] == low:
+                    start, end = self.offsets[position : position + 2]
+                    urls.append(
+                        bytes(self.blob[int(start) : int(end)]).decode("utf-8")
+                    )
+                    break
+                position += 1
+            else:
+                urls.append(None)
+        return urls
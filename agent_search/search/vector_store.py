@@ -0,0 +1,939 @@
+import asyncio
+import json
+import logging
+import os
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from agent_search.core.utils import normalize_vector, top_k_indices
+
+from .domain_ranks import DomainResolver
+from .precision import SearchPrecision
+from .url_ids import UrlIdMap
+
+logger = logging.getLogger(__name__)
+
+
+class VectorHit(NamedTuple):
+    """A scored point returned by a vector store"""
+
+    id: Any
+    score: float
+    payload: Dict[str, Any]
+
+
+class SearchFilter(NamedTuple):
+    """Payload filters pushed down into the vector store.
+
+    A point matches when its URL contains any of `url_contains`, and its host
+    or registered domain is one of `domains`. Empty lists do not filter.
+    """
+
+    url_contains: Sequence[str] = ()
+    domains: Sequence[str] = ()
+
+    def is_empty(self) -> bool:
+        return not self.url_contains and not self.domains
+
+    def matches(self, payload: Dict[str, Any]) -> bool:
+        url = payload.get("url", "")
+        if self.url_contains and not any(s in url for s in self.url_contains):
+            return False
+        if self.domains:
+            host = payload.get("host") or url_host(url)
+            domain = payload.get("domain") or _resolver.registered_domain(host)
+            return host in self.domains or domain in self.domains
+        return True
+
+
+_resolver = DomainResolver()
+
+
+def url_host(url: str) -> str:
+    try:
+        return (urlsplit(url).hostname or "").rstrip(".")
+    except ValueError:
+        return ""
+
+
+def url_payload(url: str, text: str) -> Dict[str, Any]:
+    """The payload stored with a URL's vector, including the fields filters run on"""
+    host = url_host(url)
+    return {
+        "text": text,
+        "url": url,
+        "host": host,
+        "domain": _resolver.registered_domain(host),
+    }
+
+
+def project_payload(
+    payload: Dict[str, Any], payload_fields: Optional[Sequence[str]]
+) -> Dict[str, Any]:
+    """Keeps only `payload_fields` of the payload, all of it when None"""
+    if payload_fields is None:
+        return payload
+    return {k: payload[k] for k in payload_fields if k in payload}
+
+
+class VectorSearch(NamedTuple):
+    """One search of a batch, with the arguments of VectorStore.search"""
+
+    query_vector: np.ndarray
+    limit: int = 100
+    search_filter: Optional[SearchFilter] = None
+    payload_fields: Optional[Sequence[str]] = None
+    precision: Optional[SearchPrecision] = None
+
+
+def best_per_group(
+    hits: Sequence[VectorHit], group_by: str, limit: int
+) -> List[VectorHit]:
+    """The first, i.e. best scoring, hit of each of the first 'limit' groups"""
+    seen_groups = set()
+    groups = []
+    for hit in hits:
+        group = hit.payload.get(group_by) if hit.payload else None
+        if group is None or group in seen_groups:
+            continue
+        seen_groups.add(group)
+        groups.append(hit)
+        if len(groups) >= limit:
+            break
+    return groups
+
+
+class VectorStore(ABC):
+    """The vector index searched by the broad stage of a WebSearchEngine"""
+
+    # The fallback grouped search over-fetches by this factor, doubling the
+    # fetch up to the maximum until it finds enough groups
+    group_oversampling = 2
+    max_group_fetch = 10_000
+
+    def connect(self):
+        """Opens the connections needed by the blocking methods"""
+
+    async def aconnect(self):
+        """Opens the connections needed by the async methods"""
+
+    @abstractmethod
+    def search(
+        self,
+        query_vector: np.ndarray,
+        limit: int = 100,
+        search_filter: Optional[SearchFilter] = None,
+        payload_fields: Optional[Sequence[str]] = None,
+        precision: Optional[SearchPrecision] = None,
+    ) -> List[VectorHit]:
+        """Returns the 'limit' points most similar to the query vector which match the filter.
+
+        Payloads are projected onto `payload_fields`, or returned in full when None,
+        and `precision` tunes the ANN search where the store supports it.
+        """
+
+    async def asearch(
+        self,
+        query_vector: np.ndarray,
+        limit: int = 100,
+        search_filter: Optional[SearchFilter] = None,
+        payload_fields: Optional[Sequence[str]] = None,
+        precision: Optional[SearchPrecision] = None,
+    ) -> List[VectorHit]:
+        """Async search, which runs the blocking search in a worker thread by default"""
+        return await asyncio.to_thread(
+            self.search,
+            query_vector,
+            limit,
+            search_filter,
+            payload_fields,
+            precision,
+        )
+
+    def search_batch(
+        self, searches: Sequence[VectorSearch]
+    ) -> List[List[VectorHit]]:
+        """Runs several searches, stores which can batch them in one request override this loop"""
+        return [self.search(*search) for search in searches]
+
+    async def asearch_batch(
+        self, searches: Sequence[VectorSearch]
+    ) -> List[List[VectorHit]]:
+        """Async batched search, which runs the blocking one in a worker thread by default"""
+        return await asyncio.to_thread(self.search_batch, searches)
+
+    def search_groups(
+        self,
+        query_vector: np.ndarray,
+        limit: int = 100,
+        search_filter: Optional[SearchFilter] = None,
+        payload_fields: Optional[Sequence[str]] = None,
+        group_by: str = "url",
+        precision: Optional[SearchPrecision] = None,
+    ) -> List[VectorHit]:
+        """Returns the best scoring point of each of the 'limit' best groups of points sharing the `group_by` payload field.
+
+        This fallback over-fetches and dedupes, stores which can group natively override it.
+        """
+        if payload_fields is not None and group_by not in payload_fields:
+            payload_fields = [*payload_fields, group_by]
+        fetch = limit * self.group_oversampling
+        while True:
+            hits = self.search(
+                query_vector,
+                fetch,
+                search_filter,
+                payload_fields,
+                precision=precision,
+            )
+            groups = best_per_group(hits, group_by, limit)
+            if (
+                len(groups) >= limit
+                or len(hits) < fetch
+                or fetch >= self.max_group_fetch
+            ):
+                return groups
+            fetch = min(2 * fetch, self.max_group_fetch)
+
+    async def asearch_groups(
+        self,
+        query_vector: np.ndarray,
+        limit: int = 100,
+        search_filter: Optional[SearchFilter] = None,
+        payload_fields: Optional[Sequence[str]] = None,
+        group_by: str = "url",
+        precision: Optional[SearchPrecision] = None,
+    ) -> List[VectorHit]:
+        """Async grouped search, which runs the blocking one in a worker thread by default"""
+        return await asyncio.to_thread(
+            self.search_groups,
+            query_vector,
+            limit,
+            search_filter,
+            payload_fields,
+            group_by,
+            precision,
+        )
+
+    async def _asearch_groups_by_search(
+        self,
+        query_vector: np.ndarray,
+        limit: int = 100,
+        search_filter: Optional[SearchFilter] = None,
+        payload_fields: Optional[Sequence[str]] = None,
+        group_by: str = "url",
+        precision: Optional[SearchPrecision] = None,
+    ) -> List[VectorHit]:
+        """The fallback of `search_groups` over `asearch`, for stores with an async client"""
+        if payload_fields is not None and group_by not in payload_fields:
+            payload_fields = [*payload_fields, group_by]
+        fetch = limit * self.group_oversampling
+        while True:
+            hits = await self.asearch(
+                query_vector,
+                fetch,
+                search_filter,
+                payload_fields,
+                precision=precision,
+            )
+            groups = best_per_group(hits, group_by, limit)
+            if (
+                len(groups) >= limit
+                or len(hits) < fetch
+                or fetch >= self.max_group_fetch
+            ):
+                return groups
+            fetch = min(2 * fetch, self.max_group_fetch)
+
+    def close(self):
+        pass
+
+    async def aclose(self):
+        self.close()
+
+    @classmethod
+    def from_config(cls, config) -> "VectorStore":
+        """Builds the store selected by `vector_store` in the config"""
+        store_name = config.get("vector_store", "qdrant")
+        if store_name == "qdrant":
+            return QdrantVectorStore(config)
+        if store_name == "local":
+            return LocalVectorStore.load(
+                config["local_index_path"],
+                use_hnsw=config.getboolean("local_index_use_hnsw", False),
+                hnsw_ef=int(config.get("local_index_hnsw_ef", 64)),
+            )
+        raise ValueError(
+            f"Unknown vector_store {store_name}, expected one of qdrant or local."
+        )
+
+
+class QdrantVectorStore(VectorStore):
+    """A store backed by a Qdrant collection, over gRPC.
+
+    With a compiled URL id map, searches which only need URLs request no
+    payloads at all and resolve the returned point ids to URLs locally.
+
+    Domain filters are pushed down onto the keyword indexes of the host and
+    domain fields. URL filters are substring checks, which no payload index
+    answers exactly, so they are applied to over-fetched hits instead. The
+    over-fetched hits carry only their URLs, and the requested payloads are
+    retrieved for the matching hits alone.
+    """
+
+    # The fetch of a URL filtered search, as a factor of its limit, doubled
+    # up to the maximum until enough hits match
+    url_filter_oversampling = 4
+    max_url_filter_fetch = 10_000
+
+    def __init__(self, config):
+        self.config = config
+        self.collection_name = config["qdrant_collection_name"]
+        self.client = None
+        self.async_client = None
+        self.url_id_map = None
+        url_id_map_path = config.get("qdrant_url_id_map_path")
+        if url_id_map_path:
+            self.url_id_map = UrlIdMap(url_id_map_path)
+            logger.info(
+                f"Memory-mapped {len(self.url_id_map)} point URLs from {url_id_map_path}"
+            )
+
+    def connect(self):
+        from qdrant_client import QdrantClient
+
+        logger.info(f"Connecting to collection: {self.collection_name}")
+        self.client = QdrantClient(
+            self.config["qdrant_host"],
+            grpc_port=self.config["qdrant_grpc_port"],
+            prefer_grpc=True,
+        )
+        if not self.client.get_collection(self.collection_name):
+            raise ValueError(
+                f"Must have a Qdrant collection with the name {self.collection_name}."
+            )
+
+    async def aconnect(self):
+        from qdrant_client import AsyncQdrantClient
+
+        logger.info(f"Connecting to collection: {self.collection_name}")
+        self.async_client = AsyncQdrantClient(
+            self.config["qdrant_host"],
+            grpc_port=self.config["qdrant_grpc_port"],
+            prefer_grpc=True,
+        )
+        if not await self.async_client.get_collection(self.collection_name):
+            raise ValueError(
+                f"Must have a Qdrant collection with the name {self.collection_name}."
+            )
+
+    @staticmethod
+    def _query_filter(search_filter: Optional[SearchFilter]):
+        """Translates the domain filter into Qdrant conditions on the indexed host and domain fields"""
+        if search_filter is None or not search_filter.domains:
+            return None
+        from qdrant_client.http import models
+
+        domains = list(search_filter.domains)
+        return models.Filter(
+            should=[
+                models.FieldCondition(
+                    key="domain", match=models.MatchAny(any=domains)
+                ),
+                models.FieldCondition(
+                    key="host", match=models.MatchAny(any=domains)
+                ),
+            ]
+        )
+
+    @staticmethod
+    def _filters_urls(search_filter: Optional[SearchFilter]) -> bool:
+        return search_filter is not None and bool(search_filter.url_contains)
+
+    @staticmethod
+    def _url_matches(
+        points: Sequence[Any],
+        search_filter: SearchFilter,
+        payload_fields: Optional[Sequence[str]],
+        limit: int,
+    ) -> List[VectorHit]:
+        """The first 'limit' points matching the filter, with their payloads projected"""
+        hits = []
+        for point in points:
+            payload = point.payload or {}
+            if not search_filter.matches(payload):
+                continue
+            hits.append(
+                VectorHit(
+                    point.id,
+                    point.score,
+                    project_payload(payload, payload_fields),
+                )
+            )
+            if len(hits) >= limit:
+                break
+        return hits
+
+    def _next_url_filter_fetch(
+        self, fetch: int, fetched: int, matched: int, limit: int
+    ) -> Optional[int]:
+        """The fetch of the next round of a URL filtered search, None when it is done"""
+        if (
+            matched >= limit
+            or fetched < fetch
+            or fetch >= self.max_url_filter_fetch
+        ):
+            return None
+        return min(2 * fetch, self.max_url_filter_fetch)
+
+    @staticmethod
+    def _needs_payloads(payload_fields: Optional[Sequence[str]]) -> bool:
+        """Whether the URL filtered hits need more of their payloads than the URL"""
+        return payload_fields is None or not set(payload_fields) <= {"url"}
+
+    @staticmethod
+    def _fill_payloads(
+        hits: Sequence[VectorHit],
+        records: Sequence[Any],
+        payload_fields: Optional[Sequence[str]],
+    ) -> List[VectorHit]:
+        """Replaces the url-only payloads of the hits with the retrieved ones"""
+        payloads = {record.id: record.payload or {} for record in records}
+        return [
+            VectorHit(
+                hit.id,
+                hit.score,
+                project_payload(
+                    payloads.get(hit.id, hit.payload), payload_fields
+                ),
+            )
+            for hit in hits
+        ]
+
+    def _retrieve_payloads(
+        self,
+        hits: List[VectorHit],
+        payload_fields: Optional[Sequence[str]],
+    ) -> List[VectorHit]:
+        if not hits or not self._needs_payloads(payload_fields):
+            return hits
+        records = self.client.retrieve(
+            collection_name=self.collection_name,
+            ids=[hit.id for hit in hits],
+            with_payload=self._with_payload(payload_fields),
+        )
+        return self._fill_payloads(hits, records, payload_fields)
+
+    async def _aretrieve_payloads(
+        self,
+        hits: List[VectorHit],
+        payload_fields: Optional[Sequence[str]],
+    ) -> List[VectorHit]:
+        if not hits or not self._needs_payloads(payload_fields):
+            return hits
+        records = await self.async_client.retrieve(
+            collection_name=self.collection_name,
+            ids=[hit.id for hit in hits],
+            with_payload=self._with_payload(payload_fields),
+        )
+        return self._fill_payloads(hits, records, payload_fields)
+
+    @staticmethod
+    def _search_params(precision: Optional[SearchPrecision]):
+        """Translates the precision into Qdrant search params, None leaves the collection defaults"""
+        if precision is None or precision == SearchPrecision():
+            return None
+        from qdrant_client.http import models
+
+        quantization = None
+        if precision.rescore is not None or precision.oversampling is not None:
+            quantization = models.QuantizationSearchParams(
+                rescore=precision.rescore,
+                oversampling=precision.oversampling,
+            )
+        return models.SearchParams(
+            hnsw_ef=precision.hnsw_ef,
+            exact=precision.exact,
+            quantization=quantization,
+        )
+
+    def _uses_url_id_map(self, payload_fields: Optional[Sequence[str]]):
+        return (
+            self.url_id_map is not None
+            and payload_fields is not None
+            and set(payload_fields) <= {"url"}
+        )
+
+    def _with_payload(self, payload_fields: Optional[Sequence[str]]):
+        if payload_fields is None:
+            return True
+        if self._uses_url_id_map(payload_fields):
+            return False
+        return list(payload_fields)
+
+    def _attach_urls(self, points: Sequence[Any]) -> List[VectorHit]:
+        """Builds url-only payloads from the id map, dropping unmapped points"""
+        urls = self.url_id_map.lookup([point.id for point in points])
+        hits = [
+            VectorHit(point.id, point.score, {"url": url})
+            for point, url in zip(points, urls)
+            if url is not None
+        ]
+        if len(hits) < len(points):
+            logger.warning(
+                f"{len(points) - len(hits)} points are missing from the URL id map, recompile it"
+            )
+        return hits
+
+    def search(
+        self,
+        query_vector: np.ndarray,
+        limit: int = 100,
+        search_filter: Optional[SearchFilter] = None,
+        payload_fields: Optional[Sequence[str]] = None,
+        precision: Optional[SearchPrecision] = None,
+    ) -> List[VectorHit]:
+        if not self._filters_urls(search_filter):
+            return self._search_points(
+                query_vector, limit, search_filter, payload_fields, precision
+            )
+        fetch: Optional[int] = limit * self.url_filter_oversampling
+        while fetch is not None:
+            points = self._search_points(
+                query_vector, fetch, search_filter, ("url",), precision
+            )
+            hits = self._url_matches(points, search_filter, ("url",), limit)
+            fetch = self._next_url_filter_fetch(
+                fetch, len(points), len(hits), limit
+            )
+        return self._retrieve_payloads(hits, payload_fields)
+
+    def _search_points(
+        self,
+        query_vector: np.ndarray,
+        limit: int,
+        search_filter: Optional[SearchFilter],
+        payload_fields: Optional[Sequence[str]],
+        precision: Optional[SearchPrecision],
+    ) -> List[Any]:
+        points = self.client.search(
+            collection_name=self.collection_name,
+            query_vector=query_vector,
+            query_filter=self._query_filter(search_filter),
+            search_params=self._search_params(precision),
+            with_payload=self._with_payload(payload_fields),
+            limit=limit,
+        )
+        if self._uses_url_id_map(payload_fields):
+            return self._attach_urls(points)
+        return points
+
+    async def asearch(
+        self,
+        query_vector: np.ndarray,
+        limit: int = 100,
+        search_filter: Optional[SearchFilter] = None,
+        payload_fields: Optional[Sequence[str]] = None,
+        precision: Optional[SearchPrecision] = None,
+    ) -> List[VectorHit]:
+        if not self._filters_urls(search_filter):
+            return await self._asearch_points(
+                query_vector, limit, search_filter, payload_fields, precision
+            )
+        fetch: Optional[int] = limit * self.url_filter_oversampling
+        while fetch is not None:
+            points = await self._asearch_points(
+                query_vector, fetch, search_filter, ("url",), precision
+            )
+            hits = self._url_matches(points, search_filter, ("url",), limit)
+            fetch = self._next_url_filter_fetch(
+                fetch, len(points), len(hits), limit
+            )
+        return await self._aretrieve_payloads(hits, payload_fields)
+
+    async def _asearch_points(
+        self,
+        query_vector: np.ndarray,
+        limit: int,
+        search_filter: Optional[SearchFilter],
+        payload_fields: Optional[Sequence[str]],
+        precision: Optional[SearchPrecision],
+    ) -> List[Any]:
+        points = await self.async_client.search(
+            collection_name=self.collection_name,
+            query_vector=query_vector,
+            query_filter=self._query_filter(search_filter),
+            search_params=self._search_params(precision),
+            with_payload=self._with_payload(payload_fields),
+            limit=limit,
+        )
+        if self._uses_url_id_map(payload_fields):
+            return self._attach_urls(points)
+        return points
+
+    def _search_requests(self, searches: Sequence[VectorSearch]):
+        from qdrant_client.http import models
+
+        return [
+            models.SearchRequest(
+                vector=np.asarray(search.query_vector).tolist(),
+                filter=self._query_filter(search.search_filter),
+                params=self._search_params(search.precision),
+                with_payload=self._with_payload(search.payload_fields),
+                limit=search.limit,
+            )
+            for search in searches
+        ]
+
+    def _batch_hits(
+        self, searches: Sequence[VectorSearch], batch_points: Sequence[Any]
+    ) -> List[List[VectorHit]]:
+        return [
+            self._attach_urls(points)
+            if self._uses_url_id_map(search.payload_fields)
+            else points
+            for search, points in zip(searches, batch_points)
+        ]
+
+    def search_batch(
+        self, searches: Sequence[VectorSearch]
+    ) -> List[List[VectorHit]]:
+        """Runs the searches in one request, but for URL filtered ones which over-fetch on their own"""
+        batched = [
+            i
+            for i, search in enumerate(searches)
+            if not self._filters_urls(search.search_filter)
+        ]
+        results: List[List[VectorHit]] = [
+            [] if i in batched else self.search(*search)
+            for i, search in enumerate(searches)
+        ]
+        if batched:
+            batch_searches = [searches[i] for i in batched]
+            batch_points = self.client.search_batch(
+                collection_name=self.collection_name,
+                requests=self._search_requests(batch_searches),
+            )
+            for i, hits in zip(
+                batched, self._batch_hits(batch_searches, batch_points)
+            ):
+                results[i] = hits
+        return results
+
+    async def asearch_batch(
+        self, searches: Sequence[VectorSearch]
+    ) -> List[List[VectorHit]]:
+        """Runs the searches in one request, but for URL filtered ones which over-fetch on their own"""
+        batched = [
+            i
+            for i, search in enumerate(searches)
+            if not self._filters_urls(search.search_filter)
+        ]
+        filtered = [i for i in range(len(searches)) if i not in batched]
+        results: List[List[VectorHit]] = [[] for _ in searches]
+        for i, hits in zip(
+            filtered,
+            await asyncio.gather(
+                *(self.asearch(*searches[i]) for i in filtered)
+            ),
+        ):
+            results[i] = hits
+        if batched:
+            batch_searches = [searches[i] for i in batched]
+            batch_points = await self.async_client.search_batch(
+                collection_name=self.collection_name,
+                requests=self._search_requests(batch_searches),
+            )
+            for i, hits in zip(
+                batched, self._batch_hits(batch_searches, batch_points)
+            ):
+                results[i] = hits
+        return results
+
+    def _group_hits(
+        self,
+        groups_result: Any,
+        payload_fields: Optional[Sequence[str]],
+        group_by: str,
+    ) -> List[VectorHit]:
+        """Takes the best hit of each group, whose id is the grouped field's value"""
+        hits = []
+        for group in groups_result.groups:
+            if not group.hits:
+                continue
+            hit = group.hits[0]
+            payload = dict(hit.payload or {})
+            payload[group_by] = group.id
+            hits.append(
+                VectorHit(
+                    hit.id, hit.score, project_payload(payload, payload_fields)
+                )
+            )
+        return hits
+
+    @staticmethod
+    def _group_fields(group_by: str) -> List[str]:
+        """The fields URL filtered hits are fetched with before grouping"""
+        return ["url"] if group_by == "url" else ["url", group_by]
+
+    @staticmethod
+    def _with_group_by(
+        payload_fields: Optional[Sequence[str]], group_by: str
+    ) -> Optional[Sequence[str]]:
+        if payload_fields is None or group_by in payload_fields:
+            return payload_fields
+        return [*payload_fields, group_by]
+
+    def _group_payload(self, payload_fields, group_by):
+        """The group id carries the grouped field, so it need not be fetched"""
+        if payload_fields is None:
+            return True
+        fields = [field for field in payload_fields if field != group_by]
+        return fields or False
+
+    def search_groups(
+        self,
+        query_vector: np.ndarray,
+        limit: int = 100,
+        search_filter: Optional[SearchFilter] = None,
+        payload_fields: Optional[Sequence[str]] = None,
+        group_by: str = "url",
+        precision: Optional[SearchPrecision] = None,
+    ) -> List[VectorHit]:
+        if self._filters_urls(search_filter):
+            # Groups of hits which fail the URL filter would take up the
+            # slots of matching ones, so group the filtered hits instead,
+            # retrieving the payloads of the best hit of each group only
+            groups = super().search_groups(
+                query_vector,
+                limit,
+                search_filter,
+                self._group_fields(group_by),
+                group_by,
+                precision,
+            )
+            return self._retrieve_payloads(
+                groups, self._with_group_by(payload_fields, group_by)
+            )
+        groups_result = self.client.search_groups(
+            collection_name=self.collection_name,
+            query_vector=query_vector,
+            group_by=group_by,
+            query_filter=self._query_filter(search_filter),
+            search_params=self._search_params(precision),
+            with_payload=self._group_payload(payload_fields, group_by),
+            limit=limit,
+            group_size=1,
+        )
+        return self._group_hits(groups_result, payload_fields, group_by)
+
+    async def asearch_groups(
+        self,
+        query_vector: np.ndarray,
+        limit: int = 100,
+        search_filter: Optional[SearchFilter] = None,
+        payload_fields: Optional[Sequence[str]] = None,
+        group_by: str = "url",
+        precision: Optional[SearchPrecision] = None,
+    ) -> List[VectorHit]:
+        if self._filters_urls(search_filter):
+            groups = await self._asearch_groups_by_search(
+                query_vector,
+                limit,
+                search_filter,
+                self._group_fields(group_by),
+                group_by,
+                precision,
+            )
+            return await self._aretrieve_payloads(
+                groups, self._with_group_by(payload_fields, group_by)
+            )
+        groups_result = await self.async_client.search_groups(
+            collection_name=self.collection_name,
+            query_vector=query_vector,
+            group_by=group_by,
+            query_filter=self._query_filter(search_filter),
+            search_params=self._search_params(precision),
+            with_payload=self._group_payload(payload_fields, group_by),
+            limit=limit,
+            group_size=1,
+        )
+        return self._group_hits(groups_result, payload_fields, group_by)
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+
+    async def aclose(self):
+        if self.async_client is not None:
+            await self.async_client.close()
+
+
+class LocalVectorStore(VectorStore):
+    """An in-process store over a (memory-mapped) matrix of normalized vectors.
+
+    Searches are exact, batched matrix-vector products unless an HNSW graph
+    is loaded, in which case they are approximate. Of the search precision
+    only `exact` applies, as the graph's ef is fixed when it is loaded.
+    """
+
+    VECTORS_FILE = "vectors.npy"
+    PAYLOADS_FILE = "payloads.jsonl"
+    HNSW_FILE = "hnsw.bin"
+
+    def __init__(
+        self,
+        vectors: np.ndarray,
+        payloads: Sequence[Dict[str, Any]],
+        hnsw_index: Any = None,
+        block_size: int = 65_536,
+    ):
+        if len(vectors) != len(payloads):
+            raise ValueError(
+                f"Got {len(vectors)} vectors but {len(payloads)} payloads."
+            )
+        self.vectors = vectors
+        self.payloads = payloads
+        self.hnsw_index = hnsw_index
+        self.block_size = block_size
+
+    @staticmethod
+    def build(
+        path: str,
+        vectors: np.ndarray,
+        payloads: Sequence[Dict[str, Any]],
+        build_hnsw: bool = False,
+        hnsw_m: int = 16,
+        hnsw_ef_construction: int = 200,
+    ):
+        """Writes the normalized vectors, payloads and optional HNSW graph to `path`"""
+        os.makedirs(path, exist_ok=True)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        vectors = vectors / norms
+        np.save(os.path.join(path, LocalVectorStore.VECTORS_FILE), vectors)
+        with open(
+            os.path.join(path, LocalVectorStore.PAYLOADS_FILE), "w"
+        ) as f:
+            for payload in payloads:
+                f.write(json.dumps(payload) + "\n")
+        if build_hnsw:
+            hnswlib = _import_hnswlib()
+            index = hnswlib.Index(space="ip", dim=vectors.shape[1])
+            index.init_index(
+                max_elements=len(vectors),
+                M=hnsw_m,
+                ef_construction=hnsw_ef_construction,
+            )
+            index.add_items(vectors, np.arange(len(vectors)))
+            index.save_index(os.path.join(path, LocalVectorStore.HNSW_FILE))
+
+    @classmethod
+    def load(
+        cls, path: str, use_hnsw: bool = False, hnsw_ef: int = 64
+    ) -> "LocalVectorStore":
+        """Memory-maps the index written by `build`"""
+        vectors = np.load(os.path.join(path, cls.VECTORS_FILE), mmap_mode="r")
+        with open(os.path.join(path, cls.PAYLOADS_FILE)) as f:
+            payloads = [json.loads(line) for line in f]
+        hnsw_index = None
+        if use_hnsw:
+            hnswlib = _import_hnswlib()
+            hnsw_index = hnswlib.Index(space="ip", dim=vectors.shape[1])
+            hnsw_index.load_index(
+                os.path.join(path, cls.HNSW_FILE), max_elements=len(vectors)
+            )
+            hnsw_index.set_ef(hnsw_ef)
+        logger.info(f"Loaded local index of {len(vectors)} vectors at {path}")
+        return cls(vectors, payloads, hnsw_index=hnsw_index)
+
+    def search(
+        self,
+        query_vector: np.ndarray,
+        limit: int = 100,
+        search_filter: Optional[SearchFilter] = None,
+        payload_fields: Optional[Sequence[str]] = None,
+        precision: Optional[SearchPrecision] = None,
+    ) -> List[VectorHit]:
+        query = normalize_vector(query_vector)
+        limit = min(limit, len(self.vectors))
+        if search_filter is not None and search_filter.is_empty():
+            search_filter = None
+        use_hnsw = self.hnsw_index is not None and not (
+            precision is not None and precision.exact
+        )
+        if use_hnsw:
+            try:
+                labels, distances = self.hnsw_index.knn_query(
+                    query,
+                    k=limit,
+                    filter=None
+                    if search_filter is None
+                    else lambda i: search_filter.matches(self.payloads[i]),
+                )
+                ids, scores = labels[0], 1.0 - distances[0]
+            except RuntimeError:
+                # hnswlib raises when fewer than 'limit' points are found,
+                # as with a selective filter, so search those exactly
+                ids, scores = self._exact_search(query, limit, search_filter)
+        else:
+            ids, scores = self._exact_search(query, limit, search_filter)
+        return [
+            VectorHit(
+                int(i),
+                float(score),
+                project_payload(self.payloads[i], payload_fields),
+            )
+            for i, score in zip(ids, scores)
+        ]
+
+    def _exact_search(
+        self,
+        query: np.ndarray,
+        limit: int,
+        search_filter: Optional[SearchFilter] = None,
+    ):
+        """Scores the matrix block by block, keeping a running top 'limit'"""
+        best_ids = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start in range(0, len(self.vectors), self.block_size):
+            block = np.asarray(
+                self.vectors[start : start + self.block_size],
+                dtype=np.float32,
+            )
+            scores = block @ query
+            if search_filter is not None:
+                matches = np.fromiter(
+                    (
+                        search_filter.matches(payload)
+                        for payload in self.payloads[
+                            start : start + len(block)
+                        ]
+                    ),
+                    dtype=bool,
+                    count=len(block),
+                )
+                scores = scores[matches]
+                block_ids = np.flatnonzero(matches)
+            else:
+                block_ids = np.arange(len(block))
+            top = top_k_indices(scores, limit)
+            best_ids = np.concatenate([best_ids, block_ids[top] + start])
+            best_scores = np.concatenate([best_scores, scores[top]])
+            keep = top_k_indices(best_scores, limit)
+            best_ids, best_scores = best_ids[keep], best_scores[keep]
+        return best_ids, best_scores
+
+
+def _import_hnswlib():
+    try:
+        import hnswlib
+    except ImportError as e:
+        raise ImportError(
+            f"Error {e} while importing hnswlib. Please install it with `pip install hnswlib` to use an HNSW local index."
+        )
+    return hnswlib